@@ -11,38 +11,32 @@ from datetime import datetime, timedelta
 import numpy as np
 from matplotlib import rcParams
 from PIL import Image, ImageDraw, ImageFont
+from ingest import preparing
+import metrics
 
 
 # In[8]:
 
 
-def preparing(data):
-    data = data.copy()
-    data = data[data['Статус'] == "OK"]
-    data['Дата операции'] = pd.to_datetime(data['Дата операции'].str.split().str[0], format='%d.%m.%Y', errors='coerce')
-    data['Дата платежа'] = pd.to_datetime(data['Дата платежа'].str.split().str[0], format='%d.%м.%Y', errors='coerce')
-    
-    numeric_columns = ['Сумма операции', 'Сумма платежа', 'Бонусы (включая кэшбэк)', 
-                       'Округление на инвесткопилку', 'Сумма операции с округлением']
-    
-    for column in numeric_columns:
-        data[column] = data[column].str.replace(',', '.', regex=False)
-        data[column] = pd.to_numeric(data[column], errors='coerce')
-    
-    data['Пополнения'] = data['Сумма операции'].apply(lambda x: x if x > 0 else 0)
-    data['Траты'] = data['Сумма операции'].apply(lambda x: -x if x < 0 else 0)
-
-    return data
+@metrics.timed('advice.filter_by_date')
+def filter_by_date(data, now=None):
+    # now - дата, от которой отсчитывается последний месяц (для старых выгрузок - дата последней операции)
+    start_date, end_date = last_month_period(now)
 
+    filtered_data = data[(data['Дата операции'] >= start_date) & (data['Дата операции'] <= end_date)]
+    
+    return top_categories(filtered_data.groupby('Категория')['Траты'].sum())
 
 
-def filter_by_date(data):
-    end_date = datetime.now()
+def last_month_period(now=None):
+    end_date = now if now is not None else datetime.now()
     start_date = end_date - timedelta(days=30)
+    return start_date, end_date
 
-    filtered_data = data[(data['Дата операции'] >= start_date) & (data['Дата операции'] <= end_date)]
-    
-    df = filtered_data.groupby('Категория', as_index=False).agg({'Траты' : 'sum'})
+
+def top_categories(category_spending):
+    # category_spending - суммы трат по категориям (Series с индексом "Категория")
+    df = category_spending.rename('Траты').rename_axis('Категория').reset_index()
     total = df['Траты'].sum()
     df['percent'] = df['Траты'] / total * 100
     df = df[df['Траты'] > 0]
@@ -52,6 +46,7 @@ def filter_by_date(data):
     return df
 
 
+@metrics.timed('advice.advicing')
 def advicing(adv):
     res = []
     for index, row in adv.iterrows():
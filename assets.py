@@ -0,0 +1,106 @@
+import os
+import time
+import threading
+from functools import lru_cache
+
+import matplotlib
+from matplotlib import rcParams, font_manager
+import seaborn as sns
+from PIL import Image, ImageFont
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Картинки, которые рисуются в ответах бота - декодируются один раз на процесс
+IMAGES = ['images/patrik.jpg']
+
+# Жирный шрифт для подписей на картинках: путь из FA_FONT_PATH, затем системные шрифты,
+# затем шрифт, который поставляется вместе с matplotlib и есть всегда
+BOLD_FONTS = [
+    os.environ.get('FA_FONT_PATH', ''),
+    'C:/Windows/Fonts/arialbd.ttf',
+    '/Library/Fonts/Arial Bold.ttf',
+    '/System/Library/Fonts/Supplemental/Arial Bold.ttf',
+    '/usr/share/fonts/truetype/msttcorefonts/Arial_Bold.ttf',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf',
+    os.path.join(matplotlib.get_data_path(), 'fonts', 'ttf', 'DejaVuSans-Bold.ttf'),
+]
+
+_lock = threading.Lock()
+_images = {}
+_styled = False
+_timings = {}
+
+
+def resolve_path(path):
+    # Относительные пути ищем сначала от текущего каталога, затем от каталога бота
+    if os.path.isabs(path) or os.path.exists(path):
+        return path
+    return os.path.join(BASE_DIR, path)
+
+
+@lru_cache(maxsize=None)
+def font_family(*names):
+    # Первое из семейств, которое есть в системе; иначе стандартный шрифт matplotlib без поиска замены
+    available = {font.name for font in font_manager.fontManager.ttflist}
+    for name in names:
+        if name in available:
+            return name
+    return 'DejaVu Sans'
+
+
+@lru_cache(maxsize=None)
+def bold_font_path():
+    for path in BOLD_FONTS:
+        if path and os.path.exists(path):
+            return path
+    raise FileNotFoundError('Не найден ни один жирный шрифт, задайте путь в FA_FONT_PATH')
+
+
+@lru_cache(maxsize=None)
+def font(size):
+    return ImageFont.truetype(bold_font_path(), size)
+
+
+def image(path):
+    # Декодированная картинка; ее нельзя изменять и закрывать - она общая для всех вызовов
+    path = resolve_path(path)
+    with _lock:
+        if path not in _images:
+            loaded = Image.open(path)
+            loaded.load()
+            _images[path] = loaded
+        return _images[path]
+
+
+def apply_styles():
+    # Стиль графиков задается один раз на процесс, а не перед каждой диаграммой:
+    # результат больше не зависит от того, какой график был нарисован раньше
+    global _styled
+    with _lock:
+        if _styled:
+            return
+        sns.set(style="whitegrid")
+        rcParams['font.family'] = font_family('Benbow', 'DejaVu Sans')
+        rcParams['font.size'] = 12
+        _styled = True
+
+
+def _timed(name, func, *args):
+    start = time.perf_counter()
+    func(*args)
+    _timings[name] = time.perf_counter() - start
+
+
+def warm_up():
+    # Стили, шрифты и картинки загружаются заранее; возвращает время каждого шага в секундах
+    _timed('styles', apply_styles)
+    _timed('fonts', lambda: (font_family('Arial'), font(50)))
+    _timed('images', lambda: [image(path) for path in IMAGES])
+    return report()
+
+
+def report():
+    result = dict(_timings)
+    result['total'] = sum(_timings.values())
+    return result
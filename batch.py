@@ -0,0 +1,132 @@
+import os
+
+# Файл метрик пишет только бот; в пакетном режиме сводка по этапам печатается в конце
+os.environ.setdefault('FA_METRICS_PATH', '')
+
+import sys
+import glob
+import json
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import lazy
+import metrics
+import workers
+
+pd = lazy.module('pandas')
+ingest = lazy.module('ingest')
+cube = lazy.module('cube')
+cmal = lazy.module('common_analys')
+adv = lazy.module('advice')
+pred = lazy.module('pred')
+
+
+# Пакетная обработка выгрузок без Telegram: те же графики, советы и прогноз, что отправляет бот,
+# для каждого CSV-файла из каталога - в отдельный подкаталог с картинками и текстом советов
+
+
+def process_export(path, output_dir, months, forecast_months, engine, as_of):
+    # Один файл целиком; ошибка в файле не останавливает остальные, а попадает в сводку
+    name = os.path.splitext(os.path.basename(path))[0]
+    target = os.path.join(output_dir, name)
+    result = {'file': path, 'rows': 0, 'bytes': os.path.getsize(path), 'outputs': 0, 'error': None}
+    start = time.perf_counter()
+    try:
+        with open(path, 'rb') as file:
+            data = ingest.compact(ingest.read_export(file.read(), max_mb=float('inf')))
+        result['rows'] = len(data)
+        data_cube = cube.build_cube(data)
+        os.makedirs(target, exist_ok=True)
+
+        # Период графиков - последние months месяцев выгрузки (или до сегодняшнего дня)
+        end_date = data['Дата операции'].max() if as_of == 'export' else pd.Timestamp.now()
+        start_date, end_date = workers.period_key(end_date - pd.DateOffset(months=months), end_date)
+        processed = cmal.filter_data_by_date(start_date, end_date, data_cube)
+        for kind in workers.CHART_KINDS:
+            for index, image in enumerate(workers.render_chart(kind, processed), start=1):
+                with open(os.path.join(target, f'{kind}_{index}.png'), 'wb') as file:
+                    file.write(image.getvalue())
+                result['outputs'] += 1
+
+        advice = adv.advicing(adv.filter_by_date(data_cube, now=end_date))
+        with open(os.path.join(target, 'advice.txt'), 'w', encoding='utf-8') as file:
+            file.write('\n\n'.join(advice))
+        result['outputs'] += 1
+
+        image = pred.pred_spend(data_cube, forecast_months, engine=engine)
+        with open(os.path.join(target, 'forecast.png'), 'wb') as file:
+            file.write(image.getvalue())
+        result['outputs'] += 1
+    except Exception as e:
+        result['error'] = f'{type(e).__name__}: {e}'
+
+    result['seconds'] = time.perf_counter() - start
+    # Замеры этапов из рабочего процесса уходят в главный вместе с результатом
+    result['records'] = metrics.drain()
+    return result
+
+
+def run(files, output_dir, jobs, options):
+    if jobs == 1:
+        metrics.trace_memory()
+        for path in files:
+            yield process_export(path, output_dir, *options)
+        return
+
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=context, initializer=workers.warm_up_worker,
+                             initargs=(jobs,)) as executor:
+        futures = [executor.submit(process_export, path, output_dir, *options) for path in files]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Графики, советы и прогноз для каталога выгрузок без Telegram')
+    parser.add_argument('input_dir')
+    parser.add_argument('output_dir')
+    parser.add_argument('--pattern', default='*.csv')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='число процессов')
+    parser.add_argument('--months', type=int, default=3, help='период графиков: последние N месяцев')
+    parser.add_argument('--forecast', type=int, default=3, help='на сколько месяцев прогноз')
+    parser.add_argument('--engine', choices=['arima', 'fast', 'auto'], default=None)
+    parser.add_argument('--as-of', choices=['export', 'today'], default='export',
+                        help='от какой даты считать период: последняя операция выгрузки или сегодня')
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(os.path.join(args.input_dir, args.pattern)))
+    if not files:
+        print(f"В {args.input_dir} нет файлов {args.pattern}")
+        sys.exit(1)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    jobs = max(1, min(args.jobs, len(files)))
+    options = (args.months, args.forecast, args.engine, args.as_of)
+    results = []
+    start = time.perf_counter()
+    for result in run(files, args.output_dir, jobs, options):
+        metrics.ingest(result.pop('records'))
+        results.append(result)
+        status = result['error'] or f"{result['outputs']} файлов"
+        print(f"{os.path.basename(result['file']):>30} {result['rows']:>9} операций {result['seconds']:>7.2f} с  {status}")
+    elapsed = time.perf_counter() - start
+
+    done = [result for result in results if result['error'] is None]
+    rows = sum(result['rows'] for result in done)
+    megabytes = sum(result['bytes'] for result in done) / 1024 / 1024
+    print(f"\nОбработано {len(done)} из {len(results)} файлов за {elapsed:.1f} с, процессов: {jobs}")
+    print(f"{len(done) / elapsed:.2f} файлов/с, {rows / elapsed:,.0f} операций/с, {megabytes / elapsed:.1f} МБ/с")
+    print()
+    print(metrics.report())
+
+    with open(os.path.join(args.output_dir, 'summary.json'), 'w', encoding='utf-8') as file:
+        json.dump({'seconds': elapsed, 'jobs': jobs, 'files': results}, file, ensure_ascii=False, indent=1)
+
+    if len(done) < len(results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pred
+
+
+def make_history(categories, months, seed=0):
+    # Помесячные траты по категориям: уровень, тренд, годовая сезонность, шум, пропуски месяцев
+    # и разная длина истории (категории появляются в разное время)
+    rng = np.random.default_rng(seed)
+    periods = pd.period_range(end=pd.Period('2024-12', 'M'), periods=months, freq='M')
+    rows = []
+    for index in range(categories):
+        base = rng.lognormal(8, 0.7)
+        slope = rng.normal(0, 0.02) * base
+        season = rng.uniform(0, 0.4) * base
+        phase = rng.uniform(0, 2 * np.pi)
+        first = rng.integers(0, max(1, months - 6))
+        for step, period in enumerate(periods[first:], start=first):
+            if rng.random() < 0.1:
+                continue
+            value = base + slope * step + season * np.sin(2 * np.pi * period.month / 12 + phase)
+            value *= rng.lognormal(0, 0.25)
+            rows.append({'Дата операции': period.to_timestamp() + pd.Timedelta(days=int(rng.integers(0, 28))),
+                         'Категория': f'Категория {index}', 'Траты': max(0.0, round(value, 2)), 'Кэшбэк': 0})
+    return pd.DataFrame(rows)
+
+
+def split(data, horizon):
+    # Последние horizon месяцев откладываем для проверки точности
+    cutoff = data['Дата операции'].max().to_period('M') - horizon + 1
+    month = data['Дата операции'].dt.to_period('M')
+    actual = data[month >= cutoff].groupby('Категория')['Траты'].sum()
+    return data[month < cutoff], actual
+
+
+def evaluate(engine, train, actual, horizon, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        # Кэш моделей очищаем, чтобы мерить обучение, а не повторное чтение из кэша
+        pred.model_cache.clear()
+        start = time.perf_counter()
+        result = pred.forecast_spending_with_scaling(train, horizon, n_jobs=1, engine=engine)
+        best = min(best, time.perf_counter() - start)
+
+    forecast = result.set_index('category')['forecasted_amount'].reindex(actual.index).fillna(0)
+    # WAPE - суммарная абсолютная ошибка в долях от суммарных фактических трат
+    wape = (forecast - actual).abs().sum() / actual.sum()
+    return best, wape, len(result)
+
+
+def incremental(categories, months, new_months, repeat):
+    # Пользователь загрузил выгрузку, где добавились new_months месяцев: обновление моделей против обучения с нуля
+    data = make_history(categories, months + new_months)
+    old, _ = split(data, new_months)
+
+    refit = update = float('inf')
+    for _ in range(repeat):
+        pred.model_cache.clear()
+        start = time.perf_counter()
+        full = pred.forecast_spending_with_scaling(data, 3, n_jobs=1, engine='arima', owner='bench')
+        refit = min(refit, time.perf_counter() - start)
+
+        pred.model_cache.clear()
+        pred.forecast_spending_with_scaling(old, 3, n_jobs=1, engine='arima', owner='bench')
+        before = dict(pred.model_stats)
+        start = time.perf_counter()
+        updated = pred.forecast_spending_with_scaling(data, 3, n_jobs=1, engine='arima', owner='bench')
+        update = min(update, time.perf_counter() - start)
+
+    counts = {name: pred.model_stats[name] - before[name] for name in before}
+    full = full.set_index('category')['forecasted_amount']
+    updated = updated.set_index('category')['forecasted_amount'].reindex(full.index)
+    # Насколько прогноз обновленных моделей отличается от прогноза переобученных
+    difference = (updated - full).abs().sum() / full.sum()
+    return refit, update, counts, difference
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Скорость и точность движков прогноза')
+    parser.add_argument('--categories', type=int, nargs='+', default=[10, 30, 60])
+    parser.add_argument('--months', type=int, nargs='+', default=[8, 24])
+    parser.add_argument('--horizon', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--new-months', type=int, default=0,
+                        help='сравнить обновление моделей с обучением с нуля, когда добавилось столько месяцев')
+    args = parser.parse_args()
+
+    if args.new_months:
+        print(f"{'категорий':>10} {'месяцев':>8} {'с нуля, с':>10} {'обновление, с':>14} {'обновлено':>10} "
+              f"{'обучено':>8} {'расхождение':>12}")
+        for months in args.months:
+            for categories in args.categories:
+                refit, update, counts, difference = incremental(categories, months, args.new_months, args.repeat)
+                print(f"{categories:>10} {months:>8} {refit:>10.3f} {update:>14.3f} {counts['updated']:>10} "
+                      f"{counts['fitted']:>8} {difference:>12.1%}")
+        return
+
+    print(f"{'категорий':>10} {'месяцев':>8} {'движок':>7} {'время, с':>9} {'WAPE':>7} {'прогнозов':>10}")
+    for months in args.months:
+        for categories in args.categories:
+            train, actual = split(make_history(categories, months + args.horizon), args.horizon)
+            for engine in pred.ENGINES:
+                seconds, wape, count = evaluate(engine, train, actual, args.horizon, args.repeat)
+                print(f"{categories:>10} {months:>8} {engine:>7} {seconds:>9.3f} {wape:>7.1%} {count:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+import os
+import sys
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import ingest
+import cube
+import sessions
+from generate_export import make_export, export_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Байт на операцию в рабочем процессе и размер сессии в процессе бота')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--categories', type=int, default=14)
+    parser.add_argument('--months', type=int, default=24)
+    args = parser.parse_args()
+
+    print(f"{'операций':>10} {'таблица':>10} {'компактная':>11} {'куб':>8} {'компактный куб':>15} "
+          f"{'сессия, МБ':>11} {'компактная, МБ':>15}")
+    for rows in args.rows:
+        data = ingest.read_export(export_bytes(make_export(rows, args.categories, args.months)), max_mb=float('inf'))
+        small = ingest.compact(data)
+        data_cube = cube.build_cube(data)
+        small_cube = cube.build_cube(small)
+
+        # Таблица операций живет только в рабочем процессе, в сессии бота - куб и накопленные суммы
+        full_session = sessions.Session(data_cube, cube.PeriodIndex(data_cube), None, None)
+        small_session = sessions.Session(small_cube, cube.PeriodIndex(small_cube), None, None)
+        print(f"{rows:>10} {ingest.bytes_per_row(data):>10.0f} {ingest.bytes_per_row(small):>11.0f} "
+              f"{ingest.bytes_per_row(data_cube):>8.0f} {ingest.bytes_per_row(small_cube):>15.0f} "
+              f"{full_session.nbytes / 1024 / 1024:>11.1f} {small_session.nbytes / 1024 / 1024:>15.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import subprocess
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# Фразы, которыми пользователи задают период аналитики
+CORPUS = [
+    'последний месяц', 'Последний месяц', 'последний год', 'последние 3 месяца', 'последние 2 недели',
+    'последние 10 дней', 'лето 2023', 'Лето 2024', 'зима 2022', 'осень 2023', 'весна 2024',
+    'январь 2024', 'май 2023', 'за март 2024', 'сентябрь 2023', 'декабрь 2022', 'февраль 2024',
+    'с 01.02.2024 по 01.03.2024', 'с 15.01.2023 по 20.03.2023', '01.06.2023-31.08.2023',
+    '1/3/24-30/4/24', 'с 05.05.23 по 25.05.23', '2023', 'за 2023 год',
+    'may 2024', 'с 1 марта по 15 апреля 2024', 'покажи траты', 'лето 2023', 'май 2023',
+]
+
+
+def legacy_parse_period(text):
+    # Прежняя реализация из bot.py - для сравнения скорости и результата
+    from dateparser import parse
+    from dateparser.search import search_dates
+    from dateutil.relativedelta import relativedelta
+    from periods import get_season_dates
+
+    now = datetime.now()
+
+    if "последний месяц" in text:
+        return now - relativedelta(months=1), now
+
+    if "последний год" in text:
+        return now - relativedelta(years=1), now
+
+    season_match = re.search(r"(весна|лето|осень|зима)\s(\d{4})", text.lower())
+    if season_match:
+        season, year = season_match.groups()
+        season_dates = get_season_dates(int(year), season)
+        if season_dates:
+            return season_dates
+
+    month_year_match = re.search(r"(\w+)\s(\d{4})", text.lower())
+    if month_year_match:
+        month_name, year = month_year_match.groups()
+        month_date = parse(f"01 {month_name} {year}", settings={'DATE_ORDER': 'DMY'})
+        if month_date:
+            return month_date, month_date + relativedelta(months=1) - relativedelta(days=1)
+
+    range_patterns = [
+        r"с (\d{1,2}[./]\d{1,2}[./]\d{2,4}) по (\d{1,2}[./]\d{1,2}[./]\d{2,4})",
+        r"(\d{1,2}[./]\d{1,2}[./]\d{2,4})-(\d{1,2}[./]\d{1,2}[./]\d{2,4})"
+    ]
+    for pattern in range_patterns:
+        match = re.search(pattern, text)
+        if match:
+            start_date, end_date = (parse(value) for value in match.groups())
+            if start_date and end_date:
+                return start_date, end_date
+
+    parsed_dates = search_dates(text, settings={'PREFER_DATES_FROM': 'past'})
+    if parsed_dates and len(parsed_dates) >= 2:
+        return parsed_dates[0][1], parsed_dates[-1][1]
+
+    return None, None
+
+
+def day(value):
+    return value.strftime('%Y-%m-%d') if value else None
+
+
+def run(name, repeat):
+    # Замер в отдельном процессе: первый проход включает импорт dateparser, если он понадобился
+    if name == 'legacy':
+        func = legacy_parse_period
+    else:
+        from periods import parse_period as func
+
+    timings = []
+    results = {}
+    for attempt in range(repeat + 1):
+        for text in CORPUS:
+            start = time.perf_counter()
+            period = func(text)
+            elapsed = time.perf_counter() - start
+            timings.append((attempt, elapsed))
+            results[text] = [day(value) for value in period]
+
+    cold = sum(elapsed for attempt, elapsed in timings if attempt == 0)
+    warm = sorted(elapsed for attempt, elapsed in timings if attempt > 0)
+    return {
+        'cold': cold,
+        'warm_p50': warm[len(warm) // 2],
+        'warm_p95': warm[int(len(warm) * 0.95)],
+        'dateparser': 'dateparser' in sys.modules,
+        'results': results,
+    }
+
+
+def measure(name, repeat):
+    output = subprocess.run([sys.executable, __file__, '--run', name, '--repeat', str(repeat)],
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Скорость разбора периодов')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--run', choices=['legacy', 'fast'])
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run(args.run, args.repeat)))
+        return
+
+    legacy = measure('legacy', args.repeat)
+    fast = measure('fast', args.repeat)
+
+    print(f"{'':>8} {'первый проход, с':>17} {'p50, мкс':>10} {'p95, мкс':>10} {'dateparser':>11}")
+    for name, result in [('старый', legacy), ('новый', fast)]:
+        print(f"{name:>8} {result['cold']:>17.3f} {result['warm_p50'] * 1e6:>10.1f} "
+              f"{result['warm_p95'] * 1e6:>10.1f} {'да' if result['dateparser'] else 'нет':>11}")
+
+    print(f"\n{len(CORPUS)} фраз; расхождения со старой реализацией:")
+    for text in dict.fromkeys(CORPUS):
+        if legacy['results'][text] != fast['results'][text]:
+            print(f"  {text!r}: {legacy['results'][text]} -> {fast['results'][text]}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+from io import BytesIO
+from datetime import datetime
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import ingest
+import cube
+import common_analys as cmal
+import advice as adv
+import pred
+from generate_export import make_export, export_bytes
+
+
+# История замеров: одна строка JSON на запуск, сравнение идет с прошлым запуском с теми же параметрами
+RESULTS_PATH = os.path.join(ROOT, 'benchmarks', 'results', 'pipeline.jsonl')
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(func, repeat, setup=None):
+    best = float('inf')
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def charts(data):
+    # Каждая функция графиков - отдельный этап
+    return {
+        'spend_days': lambda: cmal.spend_days(data),
+        'all_spending': lambda: cmal.all_spending(data, BytesIO(), BytesIO(), BytesIO()),
+        'all_repl': lambda: cmal.all_repl(data, BytesIO(), BytesIO(), BytesIO()),
+        'cashback': lambda: cmal.cashback(data, 'images/patrik.jpg'),
+    }
+
+
+def run(rows, categories, months, repeat, source, seed=0):
+    raw = export_bytes(make_export(rows, categories, months, seed=seed))
+    timings = {}
+
+    timings['read_csv'], frame = measure(lambda: pd.read_csv(BytesIO(raw), encoding='cp1251', sep=';'), repeat)
+    timings['preparing'], _ = measure(lambda: ingest.preparing(frame), repeat)
+    # Чтение с подготовкой по частям - так файл читает бот
+    timings['read_export'], data = measure(lambda: ingest.read_export(raw, max_mb=float('inf')), repeat)
+    timings['build_cube'], data_cube = measure(lambda: cube.build_cube(data), repeat)
+
+    # Графики, советы и прогноз считаются по кубу (как в боте) или по операциям
+    source_data = data_cube if source == 'cube' else data
+    end_date = data['Дата операции'].max()
+    start_date = end_date - pd.DateOffset(months=12)
+    timings['filter_data_by_date'], filtered = measure(
+        lambda: cmal.filter_data_by_date(start_date, end_date, source_data), repeat)
+
+    for name, func in charts(filtered).items():
+        timings[name], _ = measure(func, repeat)
+
+    timings['advicing'], _ = measure(lambda: adv.advicing(adv.filter_by_date(source_data)), repeat)
+    # Кэш моделей очищаем перед каждым повтором - меряем обучение, а не чтение из кэша
+    timings['forecast'], _ = measure(lambda: pred.forecast_spending_with_scaling(source_data, 3, n_jobs=1),
+                                     repeat, setup=pred.model_cache.clear)
+    return timings
+
+
+def load_previous(path, params):
+    if not os.path.exists(path):
+        return None
+    previous = None
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            record = json.loads(line)
+            if record['params'] == params:
+                previous = record
+    return previous
+
+
+def save(path, record):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as file:
+        file.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Время каждого этапа: чтение, подготовка, фильтр, графики, советы, прогноз')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1_000, 100_000, 1_000_000])
+    parser.add_argument('--categories', type=int, default=14)
+    parser.add_argument('--months', type=int, default=24)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--source', choices=['cube', 'operations'], default='cube')
+    parser.add_argument('--output', default=RESULTS_PATH)
+    parser.add_argument('--tolerance', type=float, default=0.2, help='допустимое замедление этапа, доля')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+
+    regressions = []
+    for rows in args.rows:
+        params = {'rows': rows, 'categories': args.categories, 'months': args.months, 'source': args.source}
+        timings = run(rows, args.categories, args.months, args.repeat, args.source)
+        previous = load_previous(args.output, params)
+
+        print(f"\n{rows} операций, {args.categories} категорий, {args.months} мес., источник: {args.source}")
+        if previous:
+            print(f"сравнение с {previous['commit'] or '?'} от {previous['time']}")
+        print(f"{'этап':>20} {'время, с':>10} {'было, с':>10} {'изменение':>10}")
+        for stage, seconds in timings.items():
+            line = f"{stage:>20} {seconds:>10.4f}"
+            before = previous['stages'].get(stage) if previous else None
+            if before:
+                change = seconds / before - 1
+                line += f" {before:>10.4f} {change:>+10.0%}"
+                # Совсем короткие этапы не считаем: их разброс больше самой разницы
+                if change > args.tolerance and seconds - before > 0.005:
+                    line += '  регрессия'
+                    regressions.append((rows, stage))
+            print(line)
+
+        save(args.output, {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'params': params,
+            'stages': timings,
+        })
+
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+import os
+import sys
+import time
+import argparse
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ingest
+from generate_export import make_export, export_bytes
+
+
+def legacy_preparing(data):
+    # Прежняя построчная реализация - для сравнения скорости и результата
+    data = data.copy()
+    data = data[data['Статус'] == "OK"]
+    data['Дата операции'] = pd.to_datetime(data['Дата операции'].str.split().str[0], format='%d.%m.%Y', errors='coerce')
+    data['Дата платежа'] = pd.to_datetime(data['Дата платежа'].str.split().str[0], format='%d.%m.%Y', errors='coerce')
+
+    for column in ingest.NUMERIC_COLUMNS:
+        data[column] = data[column].str.replace(',', '.', regex=False)
+        data[column] = pd.to_numeric(data[column], errors='coerce')
+
+    data['Пополнения'] = data['Сумма операции'].apply(lambda x: x if x > 0 else 0)
+    data['Траты'] = data['Сумма операции'].apply(lambda x: -x if x < 0 else 0)
+    return data
+
+
+def make_raw_export(rows, seed=0):
+    # Сырая выгрузка в том виде, в каком ее возвращает pd.read_csv
+    rng = np.random.default_rng(seed)
+    dates = pd.Timestamp('2021-01-01') + pd.to_timedelta(rng.integers(0, 3 * 365 * 86400, rows), unit='s')
+    amount = -rng.gamma(2, 400, rows).round(2)
+    amount[rng.random(rows) < 0.1] *= -5
+
+    def decimal(values):
+        return pd.Series(values).map('{:.2f}'.format).str.replace('.', ',', regex=False)
+
+    frame = pd.DataFrame({
+        'Дата операции': dates.strftime('%d.%m.%Y %H:%M:%S'),
+        'Дата платежа': dates.strftime('%d.%m.%Y'),
+        'Статус': rng.choice(['OK', 'OK', 'OK', 'FAILED'], rows),
+        'Сумма операции': decimal(amount),
+        'Сумма платежа': decimal(amount),
+        'Кэшбэк': np.where(rng.random(rows) < 0.2, rng.integers(1, 50, rows), np.nan),
+        'Категория': rng.choice(['Супермаркеты', 'Рестораны', 'Транспорт', 'Пополнения', 'Аптеки'], rows),
+        'Бонусы (включая кэшбэк)': decimal(rng.integers(0, 30, rows)),
+        'Округление на инвесткопилку': decimal(np.zeros(rows)),
+        'Сумма операции с округлением': decimal(-amount),
+    })
+
+    # Прогоняем через CSV, чтобы типы колонок были такими же, как после чтения настоящего файла
+    buffer = BytesIO()
+    frame.to_csv(buffer, sep=';', encoding='cp1251', index=False)
+    buffer.seek(0)
+    return pd.read_csv(buffer, sep=';', encoding='cp1251')
+
+
+def check_engines(rows=10_000):
+    # pyarrow и обычное чтение должны давать одну и ту же таблицу, в том числе с пустыми ячейками
+    if ingest.pa is None:
+        return
+    frame = make_export(rows)
+    for column, step in (('Категория', 50), ('Описание', 70), ('Кэшбэк', 1)):
+        frame.loc[frame.index[::step], column] = None
+    data = export_bytes(frame)
+    fast = ingest.read_export(data, engine='pyarrow', max_mb=float('inf'))
+    slow = ingest.read_export(data, engine='c', max_mb=float('inf'))
+    assert fast['Категория'].isna().any() and not (fast['Категория'] == '').any()
+    assert fast.equals(slow), 'pyarrow и обычное чтение дают разные таблицы'
+
+
+def measure(func, raw, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(raw)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Скорость preparing на больших выгрузках')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000, 500_000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    check_engines()
+    print(f"{'строк':>10} {'старый, с':>10} {'новый, с':>10} {'строк/с':>12} {'ускорение':>10}")
+    for rows in args.rows:
+        raw = make_raw_export(rows)
+        old_time, old_result = measure(legacy_preparing, raw, args.repeat)
+        new_time, new_result = measure(ingest.preparing, raw, args.repeat)
+        pd.testing.assert_frame_equal(old_result, new_result, check_dtype=False)
+        print(f"{rows:>10} {old_time:>10.3f} {new_time:>10.3f} {rows / new_time:>12,.0f} {old_time / new_time:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import lazy
+
+
+# Модули, которые не должны загружаться при импорте bot.py - им место в фоновом прогреве
+HEAVY = ['pandas', 'numpy', 'matplotlib', 'seaborn', 'scipy', 'statsmodels', 'sklearn', 'PIL', 'dateparser', 'pyarrow']
+
+
+def import_times(module):
+    # Отчет python -X importtime: (собственное время, общее время, имя модуля) в микросекундах
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=ROOT, capture_output=True, text=True, check=True)
+    wall = time.perf_counter() - start
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, total, name = line[len('import time:'):].split('|')
+        rows.append((int(own), int(total), name.rstrip()))
+    return wall, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Время импорта bot.py и проверка бюджета холодного старта')
+    parser.add_argument('--module', default='bot')
+    parser.add_argument('--budget', type=float, default=lazy.STARTUP_BUDGET, help='секунды')
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    wall, rows = import_times(args.module)
+    top_level = {name.strip(): total for _, total, name in rows if not name.startswith('  ')}
+    imported = {name.strip().split('.')[0] for _, _, name in rows}
+
+    print(f"Самые долгие импорты {args.module}:")
+    for own, total, name in sorted(rows, key=lambda row: -row[1])[:args.top]:
+        print(f"{total / 1e6:>8.3f} с  {name}")
+
+    eager = [name for name in HEAVY if name in imported]
+    total = top_level.get(args.module, sum(top_level.values())) / 1e6
+    print(f"\nИмпорт {args.module}: {total:.3f} с, запуск процесса целиком: {wall:.3f} с, бюджет: {args.budget:.3f} с")
+    if eager:
+        print(f"Тяжелые модули загружаются сразу: {', '.join(eager)}")
+
+    if total > args.budget or eager:
+        print('Бюджет холодного старта превышен')
+        sys.exit(1)
+    print('Бюджет холодного старта соблюден')
+
+
+if __name__ == '__main__':
+    main()
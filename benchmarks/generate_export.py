@@ -0,0 +1,127 @@
+import os
+import argparse
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+
+# Колонки выгрузки операций Т-Банка в том порядке, в каком они идут в файле
+COLUMNS = ['Дата операции', 'Дата платежа', 'Номер карты', 'Статус', 'Сумма операции', 'Валюта операции',
+           'Сумма платежа', 'Валюта платежа', 'Кэшбэк', 'Категория', 'MCC', 'Описание',
+           'Бонусы (включая кэшбэк)', 'Округление на инвесткопилку', 'Сумма операции с округлением']
+
+# Категории трат: (название, типичная сумма покупки в рублях, продавцы)
+CATEGORIES = [
+    ('Супермаркеты', 900, ['Пятёрочка', 'Магнит', 'Перекрёсток', 'ВкусВилл', 'Лента']),
+    ('Фастфуд', 450, ['Вкусно и точка', 'Ростикс', 'Бургер Кинг', 'Теремок']),
+    ('Рестораны', 2200, ['Шоколадница', 'Тануки', 'Кофемания', 'Якитория']),
+    ('Транспорт', 60, ['Метро', 'Мосгортранс', 'Тройка']),
+    ('Такси', 550, ['Яндекс Go', 'Ситимобил']),
+    ('Переводы', 3000, ['Иван И.', 'Мария С.', 'Алексей П.']),
+    ('Связь', 600, ['МТС', 'Билайн', 'Т-Мобайл']),
+    ('Аптеки', 700, ['Ригла', 'Горздрав', 'Аптека 36,6']),
+    ('Одежда и обувь', 3500, ['Zara', 'Спортмастер', 'Lamoda']),
+    ('Маркетплейсы', 1500, ['Ozon', 'Wildberries', 'Яндекс Маркет']),
+    ('Развлечения', 1200, ['Кинопоиск', 'Синема Парк', 'Okko']),
+    ('Дом и ремонт', 2500, ['Леруа Мерлен', 'OBI', 'Hoff']),
+    ('Топливо', 2000, ['Лукойл', 'Роснефть', 'Газпромнефть']),
+    ('Красота', 1800, ['Золотое яблоко', 'Летуаль']),
+    ('Образование', 4000, ['Skyeng', 'Нетология']),
+    ('Путешествия', 12000, ['Аэрофлот', 'РЖД', 'Островок']),
+    ('Животные', 900, ['Четыре лапы', 'Бетховен']),
+    ('Цветы', 1500, ['Флорист', 'Цветы Ру']),
+    ('Книги', 700, ['Читай-город', 'Литрес']),
+    ('Спорттовары', 2500, ['Декатлон', 'Спортмастер']),
+]
+
+INCOME = ('Пополнения', 25000, ['Зарплата', 'Перевод от Ивана И.', 'Пополнение через Сбербанк', 'Возврат'])
+
+
+def categories_for(count):
+    # Первые count категорий трат; если их нужно больше - добавляем условные категории
+    result = list(CATEGORIES[:count])
+    for index in range(len(result), count):
+        result.append((f'Категория {index + 1}', 1000, [f'Продавец {index + 1}']))
+    return result
+
+
+def decimal(values):
+    # Суммы в формате выгрузки: два знака, дробная часть через запятую
+    return pd.Series(np.char.mod('%.2f', values)).str.replace('.', ',', regex=False)
+
+
+def make_export(rows, categories=14, months=24, end=None, income_share=0.05, failed_share=0.02, seed=0):
+    # Выгрузка в том виде, в каком ее отдает банк: строки - как в файле, новые операции сверху
+    rng = np.random.default_rng(seed)
+    end = pd.Timestamp(end or pd.Timestamp.now()).floor('s')
+    start = end - pd.DateOffset(months=months)
+    seconds = int((end - start).total_seconds())
+    dates = (start + pd.to_timedelta(np.sort(rng.integers(0, seconds, rows))[::-1], unit='s'))
+
+    pool = categories_for(categories)
+    # Частоты категорий убывают как у настоящих трат: продукты и транспорт чаще путешествий
+    weights = 1 / np.arange(1, len(pool) + 1)
+    weights = weights / weights.sum() * (1 - income_share)
+    pool = pool + [INCOME]
+    weights = np.append(weights, income_share)
+
+    index = rng.choice(len(pool), rows, p=weights)
+    names = np.array([name for name, _, _ in pool], dtype=object)
+    typical = np.array([amount for _, amount, _ in pool])
+    amount = (typical[index] * rng.lognormal(0, 0.6, rows)).round(2)
+    amount = np.where(index == len(pool) - 1, amount, -amount)
+
+    descriptions = np.empty(rows, dtype=object)
+    for position, (_, _, merchants) in enumerate(pool):
+        mask = index == position
+        descriptions[mask] = rng.choice(merchants, mask.sum())
+
+    cashback = np.where((amount < 0) & (rng.random(rows) < 0.3), np.floor(-amount * 0.01), np.nan)
+
+    frame = pd.DataFrame({
+        'Дата операции': dates.strftime('%d.%m.%Y %H:%M:%S'),
+        'Дата платежа': dates.strftime('%d.%m.%Y'),
+        'Номер карты': rng.choice(['*1234', '*5678'], rows),
+        'Статус': np.where(rng.random(rows) < failed_share, 'FAILED', 'OK'),
+        'Сумма операции': decimal(amount),
+        'Валюта операции': 'RUB',
+        'Сумма платежа': decimal(amount),
+        'Валюта платежа': 'RUB',
+        'Кэшбэк': pd.Series(cashback).astype('Int64'),
+        'Категория': names[index],
+        'MCC': rng.integers(1000, 9999, rows),
+        'Описание': descriptions,
+        'Бонусы (включая кэшбэк)': decimal(np.nan_to_num(cashback)),
+        'Округление на инвесткопилку': decimal(np.zeros(rows)),
+        'Сумма операции с округлением': decimal(np.abs(amount)),
+    })
+    return frame[COLUMNS]
+
+
+def export_bytes(frame):
+    # Содержимое файла: cp1251 и ';' как в настоящей выгрузке
+    buffer = BytesIO()
+    frame.to_csv(buffer, sep=';', encoding='cp1251', index=False)
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Синтетическая выгрузка операций Т-Банка')
+    parser.add_argument('output')
+    parser.add_argument('--rows', type=int, default=10_000)
+    parser.add_argument('--categories', type=int, default=14)
+    parser.add_argument('--months', type=int, default=24)
+    parser.add_argument('--end', default=None, help='дата последней операции (по умолчанию - сейчас)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    frame = make_export(args.rows, args.categories, args.months, args.end, seed=args.seed)
+    with open(args.output, 'wb') as file:
+        file.write(export_bytes(frame))
+    print(f"{args.output}: {len(frame)} операций, {frame['Категория'].nunique()} категорий, "
+          f"{os.path.getsize(args.output) / 1024 / 1024:.1f} МБ")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,25 +1,32 @@
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-import numpy as np
-from matplotlib import rcParams
-from PIL import Image, ImageDraw, ImageFont
-import importlib
-import common_analys as cmal
-import pred
-import advice as adv 
+import time
+
+# Момент запуска - от него считается холодный старт
+STARTED = time.perf_counter()
+
 import re
-from dateparser import parse
-from dateparser.search import search_dates
-from dateutil.relativedelta import relativedelta
-from datetime import datetime
-import nest_asyncio
 import logging
 import os
-from io import BytesIO
+import nest_asyncio
+import html
+import lazy
+import media
+import metrics
+import scheduler
+import sessions
+import webhook
+import workers
+from periods import parse_period
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
 from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
 
+# pandas и модули аналитики нужны боту только для разбора ошибок и кэша - грузим их лениво
+pd = lazy.module('pandas')
+ingest = lazy.module('ingest')
+
+# Что прогревать в процессе бота: таблицы и куб приходят из пула и хранятся в сессиях.
+# Модели прогноза и отрисовка нужны только рабочим процессам, их прогревает warm_up_worker
+BOT_MODULES = ['pandas', 'ingest', 'cube']
+
 
 
 def escape_markdown_v2(text):
@@ -28,65 +35,17 @@ def escape_markdown_v2(text):
 
 
 
-def get_season_dates(year: int, season: str):
-    seasons = {
-        "весна": (datetime(year, 3, 1), datetime(year, 5, 31)),
-        "лето": (datetime(year, 6, 1), datetime(year, 8, 31)),
-        "осень": (datetime(year, 9, 1), datetime(year, 11, 30)),
-        "зима": (datetime(year, 12, 1), datetime(year + 1, 2, 28))
-    }
-    return seasons.get(season.lower())
+def split_compare_periods(text: str):
+    # "лето 2023 vs лето 2024" - оба периода одним сообщением
+    parts = re.split(r"\s+(?:vs|против)\s+", text.strip(), maxsplit=1, flags=re.IGNORECASE)
+    return parts if len(parts) == 2 else [text]
 
-def parse_period(text: str):
-    now = datetime.now()
 
-    if "последний месяц" in text:
-        end_date = now
-        start_date = now - relativedelta(months=1)
-        return start_date, end_date
-    
-    if "последний год" in text:
-        end_date = now
-        start_date = now - relativedelta(years=1)
-        return start_date, end_date
-    
-    season_match = re.search(r"(весна|лето|осень|зима)\s(\d{4})", text.lower())
-    if season_match:
-        season, year = season_match.groups()
-        year = int(year)
-        season_dates = get_season_dates(year, season)
-        if season_dates:
-            return season_dates
-
-    month_year_match = re.search(r"(\w+)\s(\d{4})", text.lower())
-    if month_year_match:
-        month_name, year = month_year_match.groups()
-        month_date = parse(f"01 {month_name} {year}", settings={'DATE_ORDER': 'DMY'})
-        if month_date:
-            start_date = month_date
-            end_date = month_date + relativedelta(months=1) - relativedelta(days=1)
-            return start_date, end_date
-        
-    range_patterns = [
-        r"с (\d{1,2}[./]\d{1,2}[./]\d{2,4}) по (\d{1,2}[./]\d{1,2}[./]\d{2,4})",
-        r"(\d{1,2}[./]\d{1,2}[./]\d{2,4})-(\d{1,2}[./]\d{1,2}[./]\d{2,4})"
-    ]
-    
-    for pattern in range_patterns:
-        match = re.search(pattern, text)
-        if match:
-            start_str, end_str = match.groups()
-            start_date = parse(start_str)
-            end_date = parse(end_str)
-            if start_date and end_date:
-                return start_date, end_date
-
-    parsed_dates = search_dates(text, settings={'PREFER_DATES_FROM': 'past'})
-    
-    if parsed_dates and len(parsed_dates) >= 2:
-        return parsed_dates[0][1], parsed_dates[-1][1]
-    
-    return None, None
+def period_label(text: str, start_date, end_date):
+    label = text.strip()
+    if len(label) > 30:
+        label = f"{start_date:%d.%m.%Y}-{end_date:%d.%m.%Y}"
+    return label
 
 
 nest_asyncio.apply()
@@ -98,8 +57,24 @@ logger = logging.getLogger(__name__)
 with open('mytoken.txt', 'r') as file:
     TOKEN = file.readline().strip()
 
+# polling - бот сам запрашивает обновления у Telegram, webhook - Telegram присылает их на локальный HTTP-сервер
+MODE = os.environ.get('FA_MODE', 'polling')
 
 
+# Подпись к картинкам-инструкции, как выгрузить операции из банка
+INSTRUCTION_CAPTION = (
+    "К сожалению, я пока не могу получить доступ к твоим финансам напрямую😔\n\n"
+    "🔆Скачай, пожалуйста, выгрузку по операциям из твоего мобильного банка в формате ***csv*** и пришли мне файл в чат🔆\n\n"
+    "Чтобы получить файл со своими операциями:\n"
+    "1️⃣Зайдите в ***личный кабинет Т\-банка*** на своём ***ПК***\n"
+    "2️⃣Перейдите во вкладку ***Операции***\n"
+    "3️⃣Найдите стрелочку для выгрузки Ваших операций\n"
+    "4️⃣Скачайте файл в формате ***csv***\n"
+)
+
+
+
+@metrics.timed('bot.start')
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.info("Команда /start вызвана")
     welcome_message = "Привет, я чат-бот, который поможет тебе разобраться в твоих финансах!\n\n👉Я могу проанализировать твои расходы и доходы.\n\n👉Дать пару советов как сэкономить хорошую часть твоих доходов.\n\n👉Предсказать твои будущие траты!\n\nНажми на кнопку, и мы начнём работать👻"
@@ -110,6 +85,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
 
 
+@metrics.timed('bot.button_click')
 async def button_click(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     await query.answer()
@@ -123,27 +99,12 @@ async def button_click(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             logger.error(f"Ошибка при удалении сообщения: {e}")
 
     if query.data == 'start':
-        caption = (
-            "К сожалению, я пока не могу получить доступ к твоим финансам напрямую😔\n\n"
-            "🔆Скачай, пожалуйста, выгрузку по операциям из твоего мобильного банка в формате ***csv*** и пришли мне файл в чат🔆\n\n"
-            "Чтобы получить файл со своими операциями:\n"
-            "1️⃣Зайдите в ***личный кабинет Т\-банка*** на своём ***ПК***\n"
-            "2️⃣Перейдите во вкладку ***Операции***\n"
-            "3️⃣Найдите стрелочку для выгрузки Ваших операций\n"
-            "4️⃣Скачайте файл в формате ***csv***\n"
-        )
-
-        photos = [
-            InputMediaPhoto(open('inst1.jpg', 'rb'), caption=caption, parse_mode='MarkdownV2'),
-            InputMediaPhoto(open('inst2.jpg', 'rb')),
-            InputMediaPhoto(open('inst3.jpg', 'rb'))
-        ]
-
-        new_message = await query.message.reply_media_group(media=photos)
+        new_message = await media.send_album(query.message, media.INSTRUCTION, INSTRUCTION_CAPTION, 'MarkdownV2')
         context.user_data['previous_message_id'] = new_message[0].message_id
 
 
         
+@metrics.timed('bot.handle_post_upload')
 async def handle_post_upload(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     await query.answer()
@@ -161,9 +122,12 @@ async def handle_post_upload(update: Update, context: ContextTypes.DEFAULT_TYPE)
         context.user_data['awaiting_date_period'] = True 
 
     elif query.data == 'save_money':
-        df = context.user_data.get('df')
-        filtered_data = adv.filter_by_date(df)
-        advice_list = adv.advicing(filtered_data)
+        session = await user_session(update)
+        if session is None:
+            return
+        advice_list = await run_job(update, 'advice', workers.run_heavy, workers.advice_job, session.cube)
+        if advice_list is None:
+            return
         advice_text = "\n\n".join(advice_list)
         new_message = await query.message.reply_text(escape_markdown_v2(advice_text), parse_mode='MarkdownV2')
 
@@ -178,12 +142,46 @@ async def handle_post_upload(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await query.message.reply_text("Введите количество месяцев, на которое вы хотите получить предсказание🤑")
         context.user_data['awaiting_forecast'] = True 
 
+    elif query.data == 'compare':
+        await query.message.reply_text("Введите первый период для сравнения👀\n\nМожно сразу оба, например: лето 2023 vs лето 2024")
+        context.user_data['awaiting_compare'] = True
+        context.user_data.pop('compare_first', None)
+
     elif query.data == 'exit':
         context.user_data.clear()
-        await query.message.reply_text("Спасибо за использование бота! Если захотите продолжить, просто отправьте команду /start.")
+        await sessions.store.drop(update.effective_user.id)
+        await query.message.reply_text("Спасибо за использование бота! Если захотите продолжить, просто отправьте команду /start.\n\n"
+                                       + forget_note())
         await start(update, context)
 
 
+@metrics.timed('bot.send_comparison')
+async def send_comparison(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    first_period, first_label = context.user_data.pop('compare_first')
+    second_period, second_label = context.user_data.pop('compare_second')
+    context.user_data.pop('awaiting_compare', None)
+
+    session = await user_session(update)
+    if session is None:
+        return
+    await update.message.reply_text("Вас понял, одну минуту!")
+    result = await run_job(update, 'compare', workers.run_heavy, workers.compare_job, session.period_index,
+                           first_period, second_period, [first_label, second_label])
+    if result is None:
+        return
+    image, summary = result
+    new_message = await update.message.reply_photo(photo=image, caption=summary)
+
+    keyboard = [
+        [InlineKeyboardButton("Сравнить другие периоды", callback_data='another_compare')],
+        [InlineKeyboardButton("Назад", callback_data='back')],
+        [InlineKeyboardButton("Выход", callback_data='exit')]
+    ]
+    await new_message.reply_text("Что вы хотите сделать дальше?", reply_markup=InlineKeyboardMarkup(keyboard))
+    context.user_data['previous_message_id'] = new_message.message_id
+
+
+@metrics.timed('bot.handle_text_input')
 async def handle_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_input = update.message.text
     
@@ -193,57 +191,24 @@ async def handle_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
         if start_date != None and end_date != None:
             context.user_data['start_date'] = start_date
             context.user_data['end_date'] = end_date
-            context.user_data.pop('awaiting_date_period')  
-            
-            new_message = await update.message.reply_text("Вас понял, одну минуту!")
 
-            df = context.user_data.get('df')
+            new_message = await update.message.reply_text("Вас понял, одну минуту!")
 
             start_date = context.user_data.get('start_date')
             end_date = context.user_data.get('end_date')
 
-            processed_df = cmal.filter_data_by_date(start_date, end_date, df)
-
-            results = []
-            image_path = 'output_spend_days.png'
-            cmal.spend_days(processed_df, image_path)
-            results.append(image_path)
-
-            f1 = 'output_all_spend1.png'
-            f2 = 'output_all_spend2.png'
-            f3 = 'output_all_spend3.png'
-            count = cmal.all_spending(processed_df, f1, f2, f3)
-            if count == 2:
-                results.append(f1)
-                results.append(f2)
-            else:
-                results.append(f3)
-
-            ff1 = 'output_all_repl1.png'
-            ff2 = 'output_all_repl2.png'
-            ff3 = 'output_all_repl3.png'
-            count_1 = cmal.all_repl(processed_df, ff1, ff2, ff3)
-            if count_1 == 2:
-                results.append(ff1)
-                results.append(ff2)
-            else:
-                results.append(ff3)
-
-            im_cash = 'cashback.png'
-            cmal.cashback(processed_df, 'images/patrik.jpg', im_cash)
-            results.append(im_cash)
-
-            media = []
-            for image_path in results:
-                with open(image_path, 'rb') as image_file:
-                    media.append(InputMediaPhoto(image_file))
+            session = await user_session(update)
+            if session is None:
+                return
+            # Флаг ожидания снимаем только после ответа: новый период, введенный до него, заменит этот запрос
+            images = await run_job(update, 'analytics', workers.analytics, session.cube, session.fingerprint, start_date, end_date)
+            if images is None:
+                return
+            context.user_data.pop('awaiting_date_period', None)
 
+            media = [InputMediaPhoto(image) for image in images]
             await update.message.reply_media_group(media=media)
 
-            for im in results:
-                os.remove(im)
-
-
             new_message = await update.message.reply_text("Надеюсь, моя аналитика вам поможет!🥺")
 
             keyboard = [
@@ -261,12 +226,14 @@ async def handle_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
     elif context.user_data.get('awaiting_forecast'):
         try:
             count = int(user_input)
-            df = context.user_data.get('df')
-            f1 = "forecast.png"
-            pred.pred_spend(df, count, f1)
-            with open(f1, 'rb') as image_file:
-                new_message = await update.message.reply_photo(photo=image_file)
-            os.remove(f1)
+            session = await user_session(update)
+            if session is None:
+                return
+            image = await run_job(update, 'forecast', workers.forecast, session.cube, session.fingerprint, count,
+                                  owner=update.effective_user.id)
+            if image is None:
+                return
+            new_message = await update.message.reply_photo(photo=image)
             context.user_data.pop('awaiting_forecast')  
 
             keyboard = [
@@ -278,11 +245,29 @@ async def handle_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
             context.user_data['previous_message_id'] = new_message.message_id
         except ValueError:
             await update.message.reply_text("Пожалуйста, введите корректное количество месяцев (целое число).")
+
+    elif context.user_data.get('awaiting_compare'):
+        parts = split_compare_periods(user_input)
+        if len(parts) == 2:
+            context.user_data.pop('compare_first', None)
+        for part in parts:
+            start_date, end_date = parse_period(part)
+            if start_date is None or end_date is None:
+                await update.message.reply_text(f"Не понял период «{part.strip()}», введите его по-другому, пожалуйста🥺")
+                return
+            key = 'compare_second' if 'compare_first' in context.user_data else 'compare_first'
+            context.user_data[key] = ((start_date, end_date), period_label(part, start_date, end_date))
+
+        if 'compare_second' in context.user_data:
+            await send_comparison(update, context)
+        else:
+            await update.message.reply_text("Теперь введите второй период👀")
     else:
         await handle_date_input(update, context)  
 
 
 
+@metrics.timed('bot.handle_document')
 async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     file = update.message.document
     logger.info(f"Received document: {file.file_name}")
@@ -304,23 +289,30 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     try:
         file_obj = await file.get_file()
         file_data = await file_obj.download_as_bytearray()
-        file_stream = BytesIO(file_data)
-        file_stream.seek(0)
-
-        df = pd.read_csv(file_stream, encoding='cp1251', sep=';')
-        df = cmal.preparing(df)
+        # У каждого файла свой ключ: загрузка не вытесняет предыдущую, иначе ее операции не попадут в базу
+        result = await run_job(update, ('upload', file.file_unique_id), workers.run_heavy, workers.load_export,
+                               file_data, update.effective_user.id)
+        if result is None:
+            return
+        data_cube, period_index, fingerprint, rows, added = result
 
         keyboard = [
             [InlineKeyboardButton("Моя аналитика", callback_data='analytics')],
+            [InlineKeyboardButton("Сравнить периоды", callback_data='compare')],
             [InlineKeyboardButton("Хочу сэкономить", callback_data='save_money')],
             [InlineKeyboardButton("Сколько я потрачу?", callback_data='forecast')],
             [InlineKeyboardButton("Загрузить другой файл", callback_data='upload_new_file')],
             [InlineKeyboardButton("Выход", callback_data='exit')],
         ]
-        new_message = await update.message.reply_text(f"Файл {file.file_name} успешно загружен и прочитан!", reply_markup=InlineKeyboardMarkup(keyboard))
+        new_message = await update.message.reply_text(f"Файл {file.file_name} успешно загружен и прочитан! Новых операций: {added}", reply_markup=InlineKeyboardMarkup(keyboard))
         context.user_data['message_ids'] = [new_message.message_id]
-        context.user_data['df'] = df
-        context.user_data['filename'] = file.file_name
+        # Таблицы хранятся не в user_data, а в хранилище сессий с общим бюджетом памяти
+        session = await sessions.store.put(update.effective_user.id, data_cube, period_index, fingerprint, file.file_name)
+        logger.info(f"Загружено {rows} операций, сессия в памяти {session.nbytes / 1024 / 1024:.2f} МБ")
+
+    except ingest.ExportTooLarge as e:
+        logger.error(f"Слишком большой файл: {e}")
+        await update.message.reply_text(f"Файл {file.file_name} слишком большой: {e}. Попробуйте выгрузить операции за меньший период.")
 
     except pd.errors.ParserError as e:
         logger.error(f"Ошибка при чтении файла: {e}")
@@ -337,6 +329,7 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 
 
+@metrics.timed('bot.handle_followup_actions')
 async def handle_followup_actions(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     await query.answer()
@@ -366,6 +359,18 @@ async def handle_followup_actions(update: Update, context: ContextTypes.DEFAULT_
         await query.message.reply_text("Введите количество месяцев для нового прогноза🤑")
         context.user_data['awaiting_forecast'] = True
 
+    elif query.data == 'another_compare':
+        previous_message_id = context.user_data.get('previous_message_id')
+        if previous_message_id:
+            try:
+                await query.message.delete()
+            except Exception as e:
+                logger.error(f"Ошибка при удалении сообщения: {e}")
+
+        await query.message.reply_text("Введите первый период для сравнения👀\n\nМожно сразу оба, например: лето 2023 vs лето 2024")
+        context.user_data['awaiting_compare'] = True
+        context.user_data.pop('compare_first', None)
+
     elif query.data == 'back':
         previous_message_id = context.user_data.get('previous_message_id')
         if previous_message_id:
@@ -375,6 +380,7 @@ async def handle_followup_actions(update: Update, context: ContextTypes.DEFAULT_
                 logger.error(f"Ошибка при удалении сообщения: {e}")
         keyboard = [
             [InlineKeyboardButton("Моя аналитика", callback_data='analytics')],
+            [InlineKeyboardButton("Сравнить периоды", callback_data='compare')],
             [InlineKeyboardButton("Хочу сэкономить", callback_data='save_money')],
             [InlineKeyboardButton("Сколько я потрачу?", callback_data='forecast')],
             [InlineKeyboardButton("Загрузить другой файл", callback_data='upload_new_file')],
@@ -385,57 +391,139 @@ async def handle_followup_actions(update: Update, context: ContextTypes.DEFAULT_
 
     elif query.data == 'exit':
         context.user_data.clear()
-        await query.message.reply_text("Спасибо за использование бота! Если захотите продолжить, просто отправьте команду /start.")
+        await sessions.store.drop(update.effective_user.id)
+        await query.message.reply_text("Спасибо за использование бота! Если захотите продолжить, просто отправьте команду /start.\n\n"
+                                       + forget_note())
         await start(update, context)
 
 
+@metrics.timed('bot.handle_upload_new_file')
 async def handle_upload_new_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     await query.answer()
     logger.info(f"Button clicked: {query.data}")
 
     if query.data == 'upload_new_file':
-        context.user_data.pop('df', None)
-        context.user_data.pop('filename', None)
-        caption = (
-            "К сожалению, я пока не могу получить доступ к твоим финансам напрямую😔\n\n"
-            "🔆Скачай, пожалуйста, выгрузку по операциям из твоего мобильного банка в формате ***csv*** и пришли мне файл в чат🔆\n\n"
-            "Чтобы получить файл со своими операциями:\n"
-            "1️⃣Зайдите в ***личный кабинет Т\-банка*** на своём ***ПК***\n"
-            "2️⃣Перейдите во вкладку ***Операции***\n"
-            "3️⃣Найдите стрелочку для выгрузки Ваших операций\n"
-            "4️⃣Скачайте файл в формате ***csv***\n"
-        )
-        photos = [
-            InputMediaPhoto(open('images/inst1.jpg', 'rb'), caption=caption, parse_mode='MarkdownV2'),
-            InputMediaPhoto(open('images/inst2.jpg', 'rb')),
-            InputMediaPhoto(open('images/inst3.jpg', 'rb'))
-        ]
+        await sessions.store.drop(update.effective_user.id)
+        await media.send_album(query.message, media.INSTRUCTION, INSTRUCTION_CAPTION, 'MarkdownV2')
 
-        await query.message.reply_media_group(media=photos)
 
-async def main() -> None:
-    application = ApplicationBuilder().token(TOKEN).build()
+def forget_note():
+    # Сколько хранятся операции и как их удалить - сообщение при выходе
+    days = workers.store.RETENTION_DAYS
+    kept = f"{days} дней после последней загрузки" if days > 0 else "бессрочно"
+    return f"Ваши операции хранятся {kept}, чтобы новые выгрузки дополняли историю. Удалить их сразу - команда /forget."
+
+
+@metrics.timed('bot.forget')
+async def forget(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # Удаляет все сохраненные операции пользователя: следующая выгрузка начнет историю заново
+    deleted = await run_job(update, 'forget', workers.run_heavy, workers.forget_user, update.effective_user.id)
+    if deleted is None:
+        return
+    context.user_data.clear()
+    await sessions.store.drop(update.effective_user.id)
+    await update.message.reply_text(f"Ваши сохранённые операции удалены ({deleted}). Чтобы начать заново, отправьте /start.")
+
+
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # Задержки этапов за последнее окно - только для администраторов из FA_ADMIN_IDS
+    if not metrics.is_admin(update.effective_user.id):
+        await update.message.reply_text("Эта команда доступна только администраторам.")
+        return
+    session_stats = sessions.store.stats()
+    text = (metrics.report() + "\n\nСессии: в памяти {in_memory} ({memory_mb:.0f} МБ), "
+            "выгружено на диск {spilled}, загружено обратно {reloaded}".format(**session_stats)
+            + "\nЗадачи: сейчас {active}, запущено {started}, заменено {superseded}, отказов {rejected}".format(
+                **scheduler.jobs.report()))
+    await update.message.reply_text(f"<pre>{html.escape(text)}</pre>", parse_mode='HTML')
+
+
+BUSY_MESSAGE = "Сейчас у меня очень много запросов😵 Попробуйте, пожалуйста, через минуту"
+
+
+async def run_job(update: Update, kind, func, *args, **kwargs):
+    # Тяжелая задача через планировщик. None - запрос заменен более новым того же вида
+    # или бот перегружен (тогда пользователь сразу получает ответ)
+    try:
+        return await scheduler.jobs.run(update.effective_user.id, kind, func, *args, **kwargs)
+    except scheduler.Superseded:
+        return None
+    except scheduler.Busy:
+        await update.effective_message.reply_text(BUSY_MESSAGE)
+        return None
+
+
+async def user_session(update: Update):
+    # Данные загруженного файла: из памяти или с диска, если сессия была выгружена
+    session = await sessions.store.get(update.effective_user.id)
+    if session is None:
+        await update.effective_message.reply_text("Не нашёл загруженный файл, пришлите выгрузку ещё раз, пожалуйста📄")
+    return session
+
+
+def log_worker_warm_up(future) -> None:
+    try:
+        pid, timings = future.result()
+        logger.info(f"Рабочий процесс {pid} готов, прогрев стилей, шрифтов и картинок: "
+                    + ", ".join(f"{name} {seconds:.3f} с" for name, seconds in timings.items()))
+    except Exception as e:
+        logger.error(f"Ошибка при прогреве рабочего процесса: {e}")
+
+
+async def warm_up(application) -> None:
+    # Бот уже может отвечать; тяжелые модули и рабочие процессы догружаются в фоне
+    lazy.check_startup(STARTED)
+    lazy.warm_up_in_background(BOT_MODULES)
+    application.create_task(sessions.sweep_forever())
+    for future in workers.warm_up():
+        future.add_done_callback(log_worker_warm_up)
+
+
+async def shut_down(application) -> None:
+    await sessions.store.spill_all()
+
+
+def build_application(persistence=None):
+    # Приложение с обработчиками - общее для режимов polling, webhook и процессов cluster.py
+    # Обновления обрабатываются параллельно: пока у одного пользователя считается прогноз, остальные
+    # получают ответы, а новый запрос того же пользователя может заменить еще не выполненный
+    builder = ApplicationBuilder().token(TOKEN).post_init(warm_up).post_shutdown(shut_down).concurrent_updates(True)
+    if persistence is not None:
+        builder = builder.persistence(persistence)
+    application = builder.build()
 
     application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("stats", stats))
+    application.add_handler(CommandHandler("forget", forget))
 
     application.add_handler(CallbackQueryHandler(button_click, pattern='start'))
     application.add_handler(CallbackQueryHandler(handle_post_upload, pattern='analytics'))
     application.add_handler(CallbackQueryHandler(handle_post_upload, pattern='save_money'))
     application.add_handler(CallbackQueryHandler(handle_post_upload, pattern='forecast'))
+    application.add_handler(CallbackQueryHandler(handle_post_upload, pattern='compare'))
     application.add_handler(CallbackQueryHandler(handle_post_upload, pattern='exit'))
     application.add_handler(CallbackQueryHandler(handle_followup_actions, pattern='another_period'))
     application.add_handler(CallbackQueryHandler(handle_followup_actions, pattern='another_forecast_period'))
+    application.add_handler(CallbackQueryHandler(handle_followup_actions, pattern='another_compare'))
     application.add_handler(CallbackQueryHandler(handle_followup_actions, pattern='back'))
     application.add_handler(CallbackQueryHandler(handle_upload_new_file, pattern='upload_new_file'))
 
     application.add_handler(MessageHandler(filters.Document.ALL, handle_document))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_input))
+    return application
 
-    await application.run_polling()
+
+async def main() -> None:
+    application = build_application()
+    try:
+        if MODE == 'webhook':
+            await webhook.run(application)
+        else:
+            await application.run_polling()
+    finally:
+        workers.shutdown()
 
 if __name__ == "__main__":
     import asyncio
     asyncio.run(main())
-
-
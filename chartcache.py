@@ -0,0 +1,71 @@
+import os
+import time
+from collections import OrderedDict
+
+
+# Кэш готовых картинок аналитики в процессе бота. Отдельный модуль без matplotlib и seaborn:
+# процессу бота, чтобы хранить PNG-байты, библиотеки отрисовки не нужны.
+# Потолок памяти и время жизни записи в секундах
+CHART_CACHE_MB = int(os.environ.get('FA_CHART_CACHE_MB', 64))
+CHART_CACHE_TTL = int(os.environ.get('FA_CHART_CACHE_TTL', 3600))
+
+
+class ChartCache:
+    # LRU-кэш отрисованных графиков с ограничением по памяти и времени жизни.
+    # Ключ - (отпечаток данных, период, вид графика), значение - кортеж PNG-картинок.
+
+    def __init__(self, max_bytes=CHART_CACHE_MB * 1024 * 1024, ttl=CHART_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def _expire(self, now):
+        # Записи упорядочены по последнему обращению, поэтому устаревшие всегда в начале
+        while self._items:
+            key, (_, size, stored) = next(iter(self._items.items()))
+            if now - stored < self.ttl:
+                break
+            self._items.popitem(last=False)
+            self.total_bytes -= size
+
+    def get(self, key):
+        now = time.monotonic()
+        self._expire(now)
+        if key not in self._items:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._items.move_to_end(key)
+        images, size, _ = self._items[key]
+        # Обращение продлевает жизнь записи
+        self._items[key] = (images, size, now)
+        return images
+
+    def put(self, key, images):
+        images = tuple(images)
+        size = sum(len(image) for image in images)
+        if size > self.max_bytes:
+            return
+        if key in self._items:
+            self.total_bytes -= self._items.pop(key)[1]
+        self._items[key] = (images, size, time.monotonic())
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            _, (_, old_size, _) = self._items.popitem(last=False)
+            self.total_bytes -= old_size
+
+    def clear(self):
+        self._items.clear()
+        self.total_bytes = 0
+
+
+chart_cache = ChartCache()
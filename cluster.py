@@ -0,0 +1,175 @@
+import os
+import signal
+import asyncio
+import logging
+import multiprocessing
+
+from telegram import Bot, Update
+from telegram.error import NetworkError
+
+import webhook
+
+
+# Несколько процессов бота на одной машине. Главный процесс получает обновления (опросом или через вебхук)
+# и раздает их процессам по chat_id: все обновления одного чата обрабатывает один процесс,
+# поэтому его user_data, сессия и кэш графиков живут в одном месте.
+# user_data хранится в общей базе (persistence.py), сессии выгружаются в общий каталог (sessions.py)
+SHARDS = int(os.environ.get('FA_SHARDS', os.cpu_count() or 1))
+
+MODE = os.environ.get('FA_MODE', 'polling')
+
+POLL_TIMEOUT = 30
+SHUTDOWN_TIMEOUT = 30
+
+logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def shard_for(data, count):
+    # Номер процесса для обновления: по чату, для обновлений без чата (inline-запросы) - по пользователю
+    update = Update.de_json(data, None)
+    if update.effective_chat is not None:
+        key = update.effective_chat.id
+    elif update.effective_user is not None:
+        key = update.effective_user.id
+    else:
+        key = update.update_id
+    return key % count
+
+
+def shard_environment(index, count):
+    # Ядра делятся между процессами: у каждого свой пул рабочих процессов, а не пул на все ядра
+    os.environ.setdefault('FA_POOL_SIZE', str(max(1, (os.cpu_count() or 1) // count)))
+    # Свой файл метрик у каждого процесса
+    path = os.environ.get('FA_METRICS_PATH', 'metrics.prom')
+    if path:
+        base, extension = os.path.splitext(path)
+        os.environ['FA_METRICS_PATH'] = f'{base}.shard{index}{extension}'
+
+
+def run_shard(index, count, queue):
+    # Процесс бота. Ctrl+C получает вся группа процессов, а останавливает процессы главный - сигналом в очереди
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    shard_environment(index, count)
+
+    # Настройки модулей читаются при импорте, поэтому бот импортируется после shard_environment
+    import bot
+    import persistence
+
+    application = bot.build_application(persistence=persistence.SqlitePersistence())
+    asyncio.run(serve_queue(application, queue))
+
+
+async def serve_queue(application, queue):
+    # Как run_polling, только обновления приходят из очереди от главного процесса
+    loop = asyncio.get_running_loop()
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        try:
+            while True:
+                data = await loop.run_in_executor(None, queue.get)
+                if data is None:
+                    break
+                await application.update_queue.put(Update.de_json(data, application.bot))
+        finally:
+            await application.stop()
+    # Как в run_polling: post_shutdown - после Application.shutdown()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+
+
+class Router:
+
+    def __init__(self, count=SHARDS):
+        self.count = max(1, count)
+        self.context = multiprocessing.get_context('spawn')
+        self.queues = [self.context.Queue() for _ in range(self.count)]
+        self.processes = [None] * self.count
+        self.routed = [0] * self.count
+
+    def _start_shard(self, index):
+        process = self.context.Process(target=run_shard, args=(index, self.count, self.queues[index]),
+                                       name=f'bot-shard-{index}', daemon=False)
+        process.start()
+        self.processes[index] = process
+
+    def start(self):
+        for index in range(self.count):
+            self._start_shard(index)
+        logger.info(f"Запущено процессов бота: {self.count}")
+
+    async def dispatch(self, data):
+        index = shard_for(data, self.count)
+        if not self.processes[index].is_alive():
+            # Упавший процесс перезапускается; обновления, которые ждут в очереди, он обработает после старта
+            logger.error(f"Процесс бота {index} завершился с кодом {self.processes[index].exitcode}, перезапускаем")
+            self._start_shard(index)
+        self.queues[index].put(data)
+        self.routed[index] += 1
+
+    def stop(self):
+        for queue in self.queues:
+            queue.put(None)
+        for process in self.processes:
+            if process is None:
+                continue
+            process.join(SHUTDOWN_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+        logger.info("Обновлений по процессам: " + ", ".join(map(str, self.routed)))
+
+
+async def poll(bot, dispatch):
+    # Длинный опрос getUpdates в главном процессе; обработчиков здесь нет, только раздача
+    await bot.delete_webhook()
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=POLL_TIMEOUT, allowed_updates=Update.ALL_TYPES)
+        except NetworkError as e:
+            logger.error(f"Ошибка при получении обновлений: {e}")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            offset = update.update_id + 1
+            await dispatch(update.to_dict())
+
+
+async def main(count=SHARDS, mode=MODE, stop=None):
+    with open('mytoken.txt', 'r') as file:
+        token = file.readline().strip()
+
+    # Настройки вебхука проверяются до запуска процессов бота
+    secret = webhook.resolve_secret(webhook.WEBHOOK_SECRET, webhook.WEBHOOK_URL) if mode == 'webhook' else None
+    router = Router(count)
+    router.start()
+    stop = stop if stop is not None else webhook.wait_for_stop_signal()
+    try:
+        if mode == 'webhook':
+            server = await webhook.WebhookServer(None, secret=secret, dispatch=router.dispatch).start()
+            if webhook.WEBHOOK_URL:
+                async with Bot(token) as bot:
+                    await bot.set_webhook(url=webhook.WEBHOOK_URL, secret_token=secret,
+                                          allowed_updates=Update.ALL_TYPES)
+            try:
+                await stop
+            finally:
+                await server.stop()
+        else:
+            async with Bot(token) as bot:
+                polling = asyncio.ensure_future(poll(bot, router.dispatch))
+                stopping = asyncio.ensure_future(stop)
+                await asyncio.wait({polling, stopping}, return_when=asyncio.FIRST_COMPLETED)
+                polling.cancel()
+                stopping.cancel()
+                if polling.done() and not polling.cancelled():
+                    # Опрос завершился сам - только с ошибкой (например, неверный токен)
+                    polling.result()
+    finally:
+        router.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
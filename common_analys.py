@@ -5,40 +5,14 @@ from datetime import datetime
 import numpy as np
 from matplotlib import rcParams
 from PIL import Image, ImageDraw, ImageFont
+from ingest import preparing
+import render
+import assets
+import cube
+import metrics
 
 
-def preparing(data):
-    # Создаем копию данных, чтобы не изменять оригинал
-    data = data.copy()
-    
-    # Фильтруем данные по статусу
-    data = data[data['Статус'] == "OK"]
-    
-    # Убедимся, что колонки с датами содержат строки, прежде чем применять строковые методы
-    if data['Дата операции'].dtype != 'O':
-        data['Дата операции'] = data['Дата операции'].astype(str)
-    if data['Дата платежа'].dtype != 'O':
-        data['Дата платежа'] = data['Дата платежа'].astype(str)
-
-    # Преобразуем даты
-    data['Дата операции'] = pd.to_datetime(data['Дата операции'].str.split().str[0], format='%d.%m.%Y', errors='coerce')
-    data['Дата платежа'] = pd.to_datetime(data['Дата платежа'].str.split().str[0], format='%d.%m.%Y', errors='coerce')
-
-    # Преобразование числовых колонок (сначала заменяем запятые на точки)
-    numeric_columns = ['Сумма операции', 'Сумма платежа', 'Бонусы (включая кэшбэк)', 
-                       'Округление на инвесткопилку', 'Сумма операции с округлением']
-    
-    for column in numeric_columns:
-        data[column] = data[column].str.replace(',', '.', regex=False)
-        data[column] = pd.to_numeric(data[column], errors='coerce')
-    
-    # Отдельные колонки для пополнений и трат
-    data['Пополнения'] = data['Сумма операции'].apply(lambda x: x if x > 0 else 0)
-    data['Траты'] = data['Сумма операции'].apply(lambda x: -x if x < 0 else 0)
-
-    return data
-
-
+@metrics.timed('cmal.filter_data_by_date')
 def filter_data_by_date(start_date, end_date, data):
     
     filtered_data = data[(data['Дата операции'] >= start_date) & (data['Дата операции'] <= end_date)]
@@ -48,10 +22,16 @@ def filter_data_by_date(start_date, end_date, data):
 # In[3]:
 
 
-def spend_days(data, filename):
+@metrics.timed('cmal.spend_days')
+def spend_days(data, filename=None):
 
-    # Группировка данных и вычисление средних трат
-    avg_spending = data.groupby('Категория')['Траты'].mean().sort_values(ascending=False).reset_index()
+    # Группировка данных и вычисление средних трат (в кубе среднее - сумма трат на число операций)
+    if cube.is_cube(data):
+        sums = data.groupby('Категория')[['Траты', cube.COUNT_COLUMN]].sum()
+        avg_spending = (sums['Траты'] / sums[cube.COUNT_COLUMN]).rename('Траты')
+    else:
+        avg_spending = data.groupby('Категория')['Траты'].mean()
+    avg_spending = avg_spending.sort_values(ascending=False).reset_index()
 
     # Удаление строк с нулевыми значениями
     avg_spending = avg_spending[avg_spending['Траты'] > 0]
@@ -73,17 +53,25 @@ def spend_days(data, filename):
     fig_width = 8  # Ширина фигуры (можно настроить по желанию)
 
     # Настройка графика
-    plt.figure(figsize=(fig_width, fig_height)) 
-    plt.title('Средние траты по категориям (в день)', fontsize=16, fontweight='bold', fontname='Arial')
-    plt.axis('tight')
-    plt.axis('off')
+    with render.figure(figsize=(fig_width, fig_height)) as fig:
+        ax = fig.subplots()
+        ax.set_title('Средние траты по категориям (в день)', fontsize=16, fontweight='bold', fontname=assets.font_family('Arial'))
+        ax.axis('tight')
+        ax.axis('off')
+
+        # Создание таблицы
+        table = ax.table(cellText=avg_spending.values,
+                         colLabels=['Категория', 'Средние траты, руб.'],
+                         cellLoc='center',
+                         loc='center')
+
+        _style_table(table, avg_spending, gradient_colors)
 
-    # Создание таблицы
-    table = plt.table(cellText=avg_spending.values,
-                      colLabels=['Категория', 'Средние траты, руб.'],
-                      cellLoc='center',
-                      loc='center')
+        # Сохранение таблицы как изображение (в файл или буфер)
+        return render.save_figure(fig, filename, bbox_inches='tight', dpi=300)
 
+
+def _style_table(table, avg_spending, gradient_colors):
     # Настройка стиля таблицы
     table.auto_set_font_size(False)
     table.set_fontsize(12)
@@ -114,9 +102,6 @@ def spend_days(data, filename):
     table[(0, 0)].set_width(0.3)  # Уменьшаем ширину первого столбца
     table[(0, 1)].set_width(0.2)  # Уменьшаем ширину второго столбца
 
-    # Сохранение таблицы как изображение
-    plt.savefig(filename, bbox_inches='tight', dpi=300)
-
 
 # In[10]:
 
@@ -131,10 +116,56 @@ def combine_small_categories(data, threshold, oper):
     
     return data_copy
 
-def all_spending(data, f1, f2, f3):
-    rcParams['font.family'] = 'Benbow'
+def combine_small_totals(category_totals, threshold):
+    # То же, что combine_small_categories, но по уже посчитанным суммам категорий
+    total = category_totals.sum()
+    small_categories = category_totals[category_totals / total < threshold].index
+    labels = category_totals.index.where(~category_totals.index.isin(small_categories), 'Прочее')
+    return category_totals.groupby(labels).sum().rename_axis('Категория')
+
+def _pie_chart(values, colors, title, target):
+    # Круговая диаграмма по суммам категорий
+    with render.figure(figsize=(10, 8)) as fig:
+        ax = fig.subplots()
+        wedges, texts, autotexts = ax.pie(values, 
+                                          autopct='%1.1f%%', 
+                                          startangle=140, 
+                                          colors=colors)
 
-    category_spending = data.groupby('Категория')['Траты'].sum()
+        plt.setp(autotexts, size=12, weight="bold", color="white")
+        ax.legend(wedges, values.index, title="Категории", loc="center left", bbox_to_anchor=(1, 0, 0.5, 1))
+        ax.set_title(title, fontsize=16, fontweight='bold')
+        ax.axis('equal')
+        fig.tight_layout()
+
+        # Сохранение диаграммы
+        render.save_figure(fig, target, bbox_inches='tight')
+
+def _bar_chart(values, percents, colors, title, xlabel, target):
+    # Горизонтальная диаграмма с долями категорий в процентах
+    with render.figure(figsize=(10, 8)) as fig:
+        ax = fig.subplots()
+        bars = ax.barh(values.index, values, color=colors)
+
+        for bar, percent in zip(bars, percents):
+            ax.text(bar.get_width(), bar.get_y() + bar.get_height()/2, f'{percent:.1f}%', 
+                    va='center', ha='left', color='black', fontsize=10)
+
+        ax.set_title(title, fontsize=16, fontweight='bold')
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel('Категории')
+        fig.tight_layout()
+
+        render.save_figure(fig, target, bbox_inches='tight')
+
+@metrics.timed('cmal.all_spending')
+def all_spending(data, f1, f2, f3):
+    # data - операции за период или готовые суммы трат по категориям (Series).
+    # f1, f2, f3 - пути к файлам или буферы (BytesIO)
+    if isinstance(data, pd.Series):
+        category_spending = data
+    else:
+        category_spending = data.groupby('Категория')['Траты'].sum()
     total_spending = category_spending.sum()
     # Находим крупнейшую категорию
     largest_category = category_spending.idxmax()
@@ -147,77 +178,38 @@ def all_spending(data, f1, f2, f3):
     if largest_category_share > 0.5 or len(category_spending) > 16:
         if len(category_spending) > 16:
             hold = 0.08
-        data_combined = combine_small_categories(data, hold, oper="Траты")
+        category_spending_combined = combine_small_totals(category_spending, hold)
 
         # Круговая диаграмма с объединением малых категорий
-        plt.figure(figsize=(10, 8))
-        sns.set(style="whitegrid")
-
-        category_spending_combined = data_combined.groupby('Категория')['Траты'].sum()
         ttt = category_spending_combined.sum()
         category_spending_combined = category_spending_combined[category_spending_combined / ttt > 0.008]
-
-        wedges, texts, autotexts = plt.pie(category_spending_combined, 
-                                            autopct='%1.1f%%', 
-                                            startangle=140, 
-                                            colors=color_palette)
-
-        plt.setp(autotexts, size=12, weight="bold", color="white")
-        plt.legend(wedges, category_spending_combined.index, title="Категории", loc="center left", bbox_to_anchor=(1, 0, 0.5, 1))
-        plt.title('Распределение трат по категориям', fontsize=16, fontweight='bold')
-        plt.axis('equal')
-        plt.tight_layout()
-
-        # Сохранение диаграммы
-        plt.savefig(f1, bbox_inches='tight')
+        _pie_chart(category_spending_combined, color_palette, 'Распределение трат по категориям', f1)
 
         # Диаграмма по тратам без крупнейшей категории
-        plt.figure(figsize=(10, 8))
-        without_largest = data[data['Категория'] != largest_category]
-        without_largest_spending = without_largest.groupby('Категория')['Траты'].sum()
+        without_largest_spending = category_spending.drop(largest_category)
         sss = without_largest_spending.sum()
         without_largest_spending = without_largest_spending[without_largest_spending / sss > 0.008]
 
         without_largest_percentage = (without_largest_spending / total_spending) * 100
 
-        bars = plt.barh(without_largest_spending.index, without_largest_spending, color=color_palette)
-
-        for bar, percent in zip(bars, without_largest_percentage):
-            plt.text(bar.get_width(), bar.get_y() + bar.get_height()/2, f'{percent:.1f}%', 
-                     va='center', ha='left', color='black', fontsize=10)
-
-        plt.title(f'Траты без категории "{largest_category}"', fontsize=16, fontweight='bold')
-        plt.xlabel('Сумма трат')
-        plt.ylabel('Категории')
-        plt.tight_layout()
-
-        plt.savefig(f2, bbox_inches='tight')
+        _bar_chart(without_largest_spending, without_largest_percentage, color_palette,
+                   f'Траты без категории "{largest_category}"', 'Сумма трат', f2)
         return 2
     else:
         category_spending = category_spending[category_spending > 0.008]
-        plt.figure(figsize=(10, 8))
-        sns.set(style="whitegrid")
-
-        wedges, texts, autotexts = plt.pie(category_spending, 
-                                            autopct='%1.1f%%', 
-                                            startangle=140, 
-                                            colors=color_palette)
-
-        plt.setp(autotexts, size=12, weight="bold", color="white")
-        plt.legend(wedges, category_spending.index, title="Категории", loc="center left", bbox_to_anchor=(1, 0, 0.5, 1))
-        plt.title('Распределение трат по категориям', fontsize=16, fontweight='bold')
-        plt.axis('equal')
-        plt.tight_layout()
-
-        # Сохранение диаграммы
-        plt.savefig(f3, bbox_inches='tight')
+        _pie_chart(category_spending, color_palette, 'Распределение трат по категориям', f3)
         return 1
 
+@metrics.timed('cmal.all_repl')
 def all_repl(data, f1, f2, f3):
-    rcParams['font.family'] = 'Benbow'
-
     df = data.copy()
-    df.loc[df['Категория'] == 'Пополнения', 'Категория'] = df['Категория'] + ' - ' + df['Описание']
+    # В компактной таблице категории и описания - коды словаря, для склейки подписей нужны строки.
+    # astype(object), а не astype(str): в pandas до 3.0 NaN превратился бы в категорию 'nan'.
+    # Пустая категория или описание пополнения дают NaN, и такие строки, как и раньше, не попадают в группировку
+    source = cube.description_column(df)
+    categories = df['Категория'].astype(object)
+    labels = categories.str.cat(df[source].astype(object), sep=' - ')
+    df['Категория'] = categories.where(categories != 'Пополнения', labels)
 
     category_repl = df.groupby('Категория')['Пополнения'].sum()
     total_repl = category_repl.sum()
@@ -233,26 +225,9 @@ def all_repl(data, f1, f2, f3):
         data_combined_repl = combine_small_categories(df, 0.06, oper='Пополнения')
 
         # Круговая диаграмма с объединением малых категорий
-        plt.figure(figsize=(10, 8))
-        sns.set(style="whitegrid")
-
         category_spending_combined_repl = data_combined_repl.groupby('Категория')['Пополнения'].sum()
+        _pie_chart(category_spending_combined_repl, color_palette, 'Распределение пополнений по категориям', f1)
 
-        wedges, texts, autotexts = plt.pie(category_spending_combined_repl, 
-                                            autopct='%1.1f%%', 
-                                            startangle=140, 
-                                            colors=color_palette)
-
-        plt.setp(autotexts, size=12, weight="bold", color="white")
-        plt.legend(wedges, category_spending_combined_repl.index, title="Категории", loc="center left", bbox_to_anchor=(1, 0, 0.5, 1))
-        plt.title('Распределение пополнений по категориям', fontsize=16, fontweight='bold')
-        plt.axis('equal')
-        plt.tight_layout()
-
-       
-        plt.savefig(f1, bbox_inches='tight')
-        
-        plt.figure(figsize=(10, 8))
         without_largest_repl = df[df['Категория'] != largest_category_repl]
         without_largest_spending_repl = without_largest_repl.groupby('Категория')['Пополнения'].sum()
 
@@ -260,53 +235,78 @@ def all_repl(data, f1, f2, f3):
         filtered_spending_repl = without_largest_spending_repl[without_largest_percentage_repl > 0.1]
         filtered_percentage_repl = without_largest_percentage_repl[without_largest_percentage_repl > 0.1]
 
-        bars = plt.barh(filtered_spending_repl.index, filtered_spending_repl, color=color_palette)
-
-        for bar, percent in zip(bars, filtered_percentage_repl):
-            plt.text(bar.get_width(), bar.get_y() + bar.get_height()/2, f'{percent:.1f}%', 
-                     va='center', ha='left', color='black', fontsize=10)
-
-        plt.title(f'Пополнения без категории "{largest_category_repl}"', fontsize=16, fontweight='bold')
-        plt.xlabel('Сумма пополнений')
-        plt.ylabel('Категории')
-        plt.tight_layout()
-
         # Сохранение диаграммы
-        plt.savefig(f2, bbox_inches='tight')
+        _bar_chart(filtered_spending_repl, filtered_percentage_repl, color_palette,
+                   f'Пополнения без категории "{largest_category_repl}"', 'Сумма пополнений', f2)
         return 2
 
     else:
-        plt.figure(figsize=(10, 8))
-        sns.set(style="whitegrid")
+        _pie_chart(category_repl, color_palette, 'Распределение пополнений по категориям', f3)
+        return 1
 
-        wedges, texts, autotexts = plt.pie(category_repl, 
-                                            autopct='%1.1f%%', 
-                                            startangle=140, 
-                                            colors=color_palette)
 
-        plt.setp(autotexts, size=12, weight="bold", color="white")
-        plt.legend(wedges, category_repl.index, title="Категории", loc="center left", bbox_to_anchor=(1, 0, 0.5, 1))
-        plt.title('Распределение пополнений по категориям', fontsize=16, fontweight='bold')
-        plt.axis('equal')
-        plt.tight_layout()
+@metrics.timed('cmal.compare_periods')
+def compare_periods(first, second, labels, filename=None, top=12):
+    # first, second - траты по категориям за два периода (Series), labels - подписи периодов
+    totals = pd.concat([first, second], axis=1, keys=labels).fillna(0)
+    totals = totals[(totals > 0).any(axis=1)]
+    totals = totals.loc[totals.max(axis=1).sort_values(ascending=False).index[:top]][::-1]
+
+    positions = np.arange(len(totals))
+    height = 0.4
+    colors = ['#09AE86', '#8C6BB1']
+
+    with render.figure(figsize=(10, max(4, 0.6 * len(totals) + 2))) as fig:
+        ax = fig.subplots()
+        for shift, label, period, color in zip([height / 2, -height / 2], labels, [first, second], colors):
+            ax.barh(positions + shift, totals[label], height=height, color=color,
+                    label=f'{label}: {period.sum():,.0f} руб.'.replace(',', ' '))
+
+        ax.set_yticks(positions)
+        ax.set_yticklabels(totals.index)
+        ax.set_title('Сравнение трат по категориям', fontsize=16, fontweight='bold')
+        ax.set_xlabel('Сумма трат')
+        ax.legend(loc='lower right')
+        fig.tight_layout()
+
+        return render.save_figure(fig, filename, bbox_inches='tight', dpi=150)
+
+
+@metrics.timed('cmal.compare_summary')
+def compare_summary(first, second, labels):
+    # Текстовая сводка к сравнению периодов
+    first_total, second_total = first.sum(), second.sum()
+    diff = second_total - first_total
+    lines = [f'{labels[0]}: {first_total:,.0f} руб.', f'{labels[1]}: {second_total:,.0f} руб.']
+    if first_total > 0:
+        lines.append(f'Разница: {diff:+,.0f} руб. ({diff / first_total * 100:+.0f}%)')
+    else:
+        lines.append(f'Разница: {diff:+,.0f} руб.')
 
-        
-        plt.savefig(f3, bbox_inches='tight')
-        return 1
+    # Категории, где траты изменились сильнее всего
+    change = second.sub(first, fill_value=0)
+    change = change[change.abs() >= 1].sort_values(key=abs, ascending=False).head(3)
+    if len(change):
+        lines.append('')
+        lines.append('Сильнее всего изменились:')
+        for category, value in change.items():
+            lines.append(f'{category}: {value:+,.0f} руб.')
+    return '\n'.join(lines).replace(',', ' ')
 
 
-def cashback(data, image_path, output_path):
+@metrics.timed('cmal.cashback')
+def cashback(data, image_path, output_path=None):
     cash = data['Кэшбэк'].sum()
 
     text = str(cash) + ' РУБ!!!'
-    image = Image.open(image_path)
+    # Картинка и шрифт берутся из реестра: они декодируются и загружаются один раз на процесс
+    image = assets.image(image_path)
     
     # Определяем размеры изображения
     width, height = image.size
 
     font_size = 50  # Увеличьте размер шрифта по вашему желанию
-    font_path = "C:/Windows/Fonts/arialbd.ttf"  # Путь к жирному шрифту Arial
-    font = ImageFont.truetype(font_path, font_size)
+    font = assets.font(font_size)
 
     # Создаем объект для рисования
     draw = ImageDraw.Draw(image)
@@ -328,5 +328,8 @@ def cashback(data, image_path, output_path):
     draw = ImageDraw.Draw(new_image)
     draw.text((text_x, height - 80), text, font=font, fill="black")  # Небольшой отступ сверху от текста
 
-
-    new_image.save(output_path)
\ No newline at end of file
+    # Освобождаем память новой картинки сразу, не дожидаясь сборщика мусора
+    try:
+        return render.save_image(new_image, output_path)
+    finally:
+        new_image.close()
\ No newline at end of file
@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+
+import metrics
+
+
+# Куб - операции, заранее сложенные по (день, категория, источник пополнения).
+# Колонки называются так же, как в подготовленной таблице, поэтому фильтры по дате и
+# группировки по категории работают с кубом без изменений, но по числу дней и категорий, а не операций.
+SOURCE_COLUMN = 'Источник пополнения'
+COUNT_COLUMN = 'Операций'
+
+KEYS = ['Дата операции', 'Категория', SOURCE_COLUMN]
+VALUES = ['Траты', 'Пополнения', 'Кэшбэк', COUNT_COLUMN]
+
+
+def is_cube(data):
+    return COUNT_COLUMN in data.columns
+
+
+@metrics.timed('cube.build_cube')
+def build_cube(data):
+    # Для пополнений сохраняем источник (описание) - он нужен диаграмме пополнений
+    description = data['Описание']
+    if isinstance(description.dtype, pd.CategoricalDtype) and '' not in description.cat.categories:
+        # Компактная таблица: пустой источник должен быть среди значений словаря
+        description = description.cat.add_categories('')
+    source = description.where(data['Категория'] == 'Пополнения', '')
+    data = data.assign(**{SOURCE_COLUMN: source, COUNT_COLUMN: 1})
+    cube = data.groupby(KEYS, dropna=False, observed=True).agg({column: 'sum' for column in VALUES})
+    return cube.reset_index()
+
+
+def description_column(data):
+    # Колонка, из которой берется подпись пополнения: в кубе это источник, в операциях - описание
+    return SOURCE_COLUMN if is_cube(data) else 'Описание'
+
+
+class PeriodIndex:
+    # Накопленные суммы по дням для каждой категории. Сумма за любой период - разность двух строк,
+    # номер строки вычисляется из даты арифметикой, без поиска и без масок по операциям
+
+    def __init__(self, data_cube, columns=('Траты', 'Пополнения', 'Кэшбэк', COUNT_COLUMN)):
+        dated = data_cube.dropna(subset=['Дата операции', 'Категория'])
+        self.categories = pd.Index(sorted(dated['Категория'].unique()), name='Категория')
+        self._cumsum = {}
+
+        if dated.empty:
+            self.first_day = None
+            self.n_days = 0
+            for column in columns:
+                self._cumsum[column] = np.zeros((1, 0))
+            return
+
+        self.first_day = dated['Дата операции'].min().normalize()
+        days = pd.date_range(self.first_day, dated['Дата операции'].max().normalize(), freq='D')
+        self.n_days = len(days)
+
+        daily = dated.pivot_table(index='Дата операции', columns='Категория', values=list(columns),
+                                  aggfunc='sum', fill_value=0)
+        for column in columns:
+            values = daily[column].reindex(index=days, columns=self.categories, fill_value=0).to_numpy(dtype='float64')
+            # Первая строка нулевая: сумма до первого дня
+            self._cumsum[column] = np.vstack([np.zeros((1, len(self.categories))), values.cumsum(axis=0)])
+
+    def _position(self, date, round_up):
+        # Граница периода может быть со временем: начало округляем вверх, конец - вниз, как при сравнении с полуночью
+        date = pd.Timestamp(date)
+        date = date.ceil('D') if round_up else date.floor('D')
+        return (date - self.first_day).days
+
+    def _bounds(self, start_date, end_date):
+        if self.n_days == 0:
+            return 0, 0
+        start = min(max(self._position(start_date, True), 0), self.n_days)
+        end = min(max(self._position(end_date, False) + 1, 0), self.n_days)
+        return start, max(start, end)
+
+    def totals(self, start_date, end_date, column='Траты'):
+        start, end = self._bounds(start_date, end_date)
+        cumsum = self._cumsum[column]
+        return pd.Series(cumsum[end] - cumsum[start], index=self.categories, name=column)
+
+    def means(self, start_date, end_date, column='Траты'):
+        # Среднее на одну операцию (как groupby(...).mean() по операциям)
+        counts = self.totals(start_date, end_date, COUNT_COLUMN)
+        return (self.totals(start_date, end_date, column) / counts.where(counts > 0)).dropna()
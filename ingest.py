@@ -0,0 +1,196 @@
+import os
+import csv
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+import metrics
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+except ImportError:
+    pa = None
+
+
+# Числовые колонки выгрузки (в файле дробная часть отделена запятой)
+NUMERIC_COLUMNS = ['Сумма операции', 'Сумма платежа', 'Бонусы (включая кэшбэк)',
+                   'Округление на инвесткопилку', 'Сумма операции с округлением']
+
+DATE_COLUMNS = ['Дата операции', 'Дата платежа']
+
+DATE_FORMAT = '%d.%m.%Y'
+
+# Колонки, которые нужны аналитике, советам и прогнозу - остальные при чтении не загружаем
+READ_COLUMNS = DATE_COLUMNS + ['Статус', 'Категория', 'Описание', 'Кэшбэк'] + NUMERIC_COLUMNS
+
+TEXT_COLUMNS = ['Статус', 'Категория', 'Описание']
+
+# Компактный вид подготовленной таблицы: только колонки, с которыми работают аналитика, советы и прогноз
+COMPACT_COLUMNS = ['Дата операции', 'Категория', 'Описание', 'Кэшбэк', 'Пополнения', 'Траты']
+CATEGORY_COLUMNS = ['Категория', 'Описание']
+
+# 1 - хранить загруженные операции в компактном виде, 0 - со всеми колонками выгрузки
+COMPACT = int(os.environ.get('FA_COMPACT_FRAMES', 1))
+
+# Размер порции при чтении и ограничение на размер файла
+CHUNK_ROWS = int(os.environ.get('FA_CSV_CHUNK_ROWS', 100_000))
+BLOCK_MB = int(os.environ.get('FA_CSV_BLOCK_MB', 16))
+MAX_FILE_MB = int(os.environ.get('FA_CSV_MAX_MB', 50))
+
+
+class ExportTooLarge(ValueError):
+    pass
+
+
+def _to_datetime_unique(strings):
+    # В выгрузке всего несколько сотен разных дат, поэтому разбираем только уникальные строки
+    codes, uniques = pd.factorize(strings, use_na_sentinel=False)
+    parsed = pd.to_datetime(pd.Index(uniques), format=DATE_FORMAT, errors='coerce')
+    return pd.Series(parsed.take(codes), index=strings.index)
+
+
+def parse_dates(column):
+    # Даты приходят в виде "31.12.2023 12:34:56" или "31.12.2023"
+    if pd.api.types.is_datetime64_any_dtype(column):
+        # Дата уже разобрана при чтении - отбрасываем время, как и при разборе строк
+        return column.dt.normalize()
+    if not pd.api.types.is_string_dtype(column):
+        column = column.astype(str)
+
+    # Быстрый путь: дата с ведущими нулями занимает ровно 10 символов
+    dates = _to_datetime_unique(column.str.slice(0, 10))
+
+    # Строки, которые не разобрались по срезу (например, "1.6.2024"), разбираем медленным путем
+    missed = dates.isna() & column.notna()
+    if missed.any():
+        dates[missed] = _to_datetime_unique(column[missed].str.split().str[0])
+    return dates
+
+
+def parse_decimal(column):
+    # "1234,56" -> 1234.56 одной векторной операцией для всей колонки
+    if pd.api.types.is_numeric_dtype(column):
+        return column.astype('float64')
+    column = column.str.replace(',', '.', regex=False)
+    try:
+        return column.astype('float64')
+    except (ValueError, TypeError):
+        # В колонке есть нечисловые значения - они станут NaN
+        return pd.to_numeric(column, errors='coerce')
+
+
+def split_amount(amount):
+    # Пополнения - положительные суммы, траты - модуль отрицательных; NaN дает 0
+    values = amount.to_numpy(dtype='float64')
+    income = np.where(values > 0, values, 0.0)
+    spend = np.where(values < 0, -values, 0.0)
+    return pd.Series(income, index=amount.index), pd.Series(spend, index=amount.index)
+
+
+def preparing(data):
+    # Фильтруем данные по статусу (маска уже создает новую таблицу, оригинал не меняется)
+    data = data[data['Статус'] == "OK"].copy()
+
+    # Преобразуем даты
+    for column in DATE_COLUMNS:
+        data[column] = parse_dates(data[column])
+
+    # Преобразование числовых колонок (сначала заменяем запятые на точки)
+    for column in NUMERIC_COLUMNS:
+        data[column] = parse_decimal(data[column])
+
+    # Отдельные колонки для пополнений и трат
+    data['Пополнения'], data['Траты'] = split_amount(data['Сумма операции'])
+
+    return data
+
+
+def compact(data):
+    # Категории и описания - коды в словаре (сотни разных значений на сотни тысяч строк),
+    # суммы - float64 без изменений: float32 теряет копейки в итогах за несколько лет
+    data = data[[column for column in COMPACT_COLUMNS if column in data.columns]]
+    data = data.astype({column: 'category' for column in CATEGORY_COLUMNS if column in data.columns})
+    for column in ['Кэшбэк', 'Пополнения', 'Траты']:
+        if column in data.columns:
+            data[column] = data[column].astype('float64')
+    return data.reset_index(drop=True)
+
+
+def bytes_per_row(data):
+    return data.memory_usage(index=True, deep=True).sum() / max(1, len(data))
+
+
+def _read_chunks_pyarrow(data):
+    # Потоковое чтение pyarrow: типы и даты разбираются прямо при чтении, в памяти одна порция
+    column_types = {column: pa.timestamp('us') for column in DATE_COLUMNS}
+    # Кэшбэк - число, как и у обычного чтения: пустая колонка должна стать NaN, а не None
+    column_types.update({column: pa.float64() for column in NUMERIC_COLUMNS + ['Кэшбэк']})
+    column_types.update({column: pa.string() for column in TEXT_COLUMNS})
+
+    reader = pacsv.open_csv(
+        pa.BufferReader(data),
+        read_options=pacsv.ReadOptions(encoding='cp1251', block_size=BLOCK_MB * 1024 * 1024),
+        parse_options=pacsv.ParseOptions(delimiter=';'),
+        # strings_can_be_null: пустая ячейка категории или описания - NaN, как у обычного чтения, а не ''
+        convert_options=pacsv.ConvertOptions(include_columns=READ_COLUMNS,
+                                             column_types=column_types,
+                                             strings_can_be_null=True,
+                                             decimal_point=',',
+                                             timestamp_parsers=['%d.%m.%Y %H:%M:%S', DATE_FORMAT]),
+    )
+    offset = 0
+    for batch in reader:
+        chunk = batch.to_pandas()
+        # Сохраняем сквозную нумерацию строк, как при обычном чтении
+        chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+        offset += len(chunk)
+        yield chunk
+
+
+def _read_chunks_pandas(data, chunk_rows):
+    reader = pd.read_csv(BytesIO(data), encoding='cp1251', sep=';',
+                         usecols=lambda column: column in READ_COLUMNS,
+                         dtype={column: 'str' for column in TEXT_COLUMNS},
+                         decimal=',',
+                         chunksize=chunk_rows)
+    for chunk in reader:
+        # Порядок колонок - как у pyarrow (READ_COLUMNS), чтобы оба способа чтения давали одну и ту же таблицу
+        yield chunk[READ_COLUMNS]
+
+
+def missing_columns(data):
+    # Заголовок проверяется до чтения: в файле другого банка или другой версии выгрузки нет нужных колонок
+    end = data.find(b'\n')
+    header = bytes(data[:end if end >= 0 else len(data)]).decode('cp1251', errors='replace').strip()
+    columns = next(csv.reader([header], delimiter=';'), [])
+    return [column for column in READ_COLUMNS if column not in columns]
+
+
+@metrics.timed('ingest.read_export')
+def read_export(data, engine=None, chunk_rows=CHUNK_ROWS, max_mb=MAX_FILE_MB):
+    # Читает выгрузку (содержимое файла в байтах) и сразу подготавливает ее по частям.
+    # engine: 'pyarrow', 'c' или None - pyarrow, если он установлен.
+    if len(data) > max_mb * 1024 * 1024:
+        raise ExportTooLarge(f'Файл больше {max_mb} МБ')
+
+    missing = missing_columns(data)
+    if missing:
+        raise pd.errors.ParserError(f"В файле нет колонок: {', '.join(missing)}")
+
+    if engine is None:
+        engine = 'pyarrow' if pa is not None else 'c'
+
+    if engine == 'pyarrow':
+        try:
+            chunks = [preparing(chunk) for chunk in _read_chunks_pyarrow(data)]
+        except pa.ArrowException:
+            # Нестандартные значения или колонки в файле: pyarrow строг к типам, читаем обычным способом
+            return read_export(data, engine='c', chunk_rows=chunk_rows, max_mb=max_mb)
+    else:
+        chunks = [preparing(chunk) for chunk in _read_chunks_pandas(data, chunk_rows)]
+
+    if not chunks:
+        raise pd.errors.EmptyDataError('Файл не содержит операций')
+    return pd.concat(chunks)
@@ -0,0 +1,101 @@
+import os
+import time
+import logging
+import importlib
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+# Бюджет холодного старта бота в секундах (время от запуска до готовности принимать /start)
+STARTUP_BUDGET = float(os.environ.get('FA_STARTUP_BUDGET', 1.5))
+
+# 0 - не прогревать тяжелые модули в фоне, грузить только при первом обращении
+WARM_UP = int(os.environ.get('FA_WARM_UP', 1))
+
+_lock = threading.Lock()
+_modules = {}
+_timings = {}
+
+
+class LazyModule:
+    # Модуль, который импортируется при первом обращении к его атрибуту
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self, reason='первое обращение'):
+        module = self.__dict__['_module']
+        if module is None:
+            name = self.__dict__['_name']
+            start = time.perf_counter()
+            module = importlib.import_module(name)
+            with _lock:
+                # Импорт мог уже пройти в другом потоке - тогда его время почти нулевое, оставляем первое
+                _timings.setdefault(name, (time.perf_counter() - start, reason))
+            self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        state = 'загружен' if self.__dict__['_module'] is not None else 'не загружен'
+        return f"<lazy module '{self.__dict__['_name']}' ({state})>"
+
+
+def module(name):
+    # Один объект на имя модуля, чтобы прогрев был общим для всех мест, где модуль объявлен
+    with _lock:
+        if name not in _modules:
+            _modules[name] = LazyModule(name)
+        return _modules[name]
+
+
+def loaded(name):
+    return name in _modules and _modules[name].__dict__['_module'] is not None
+
+
+def warm_up(names=None):
+    # Импортирует модули names (по умолчанию - все объявленные) заранее; возвращает время импорта каждого в секундах
+    result = {}
+    for name in names or list(_modules):
+        start = time.perf_counter()
+        module(name)._load('прогрев')
+        result[name] = time.perf_counter() - start
+    return result
+
+
+def warm_up_in_background(names=None):
+    if not WARM_UP:
+        return None
+
+    def run():
+        start = time.perf_counter()
+        warm_up(names)
+        logger.info(f"Тяжелые модули прогреты за {time.perf_counter() - start:.2f} с")
+
+    thread = threading.Thread(target=run, name='warm-up', daemon=True)
+    thread.start()
+    return thread
+
+
+def report():
+    # Строки отчета "модуль - время импорта - когда загружен", самые долгие сверху
+    with _lock:
+        timings = sorted(_timings.items(), key=lambda item: -item[1][0])
+    return [f"{name}: {seconds:.3f} с ({reason})" for name, (seconds, reason) in timings]
+
+
+def check_startup(started):
+    # Сравнивает время холодного старта с бюджетом; превышение попадает в лог как предупреждение
+    elapsed = time.perf_counter() - started
+    if elapsed > STARTUP_BUDGET:
+        logger.warning(f"Холодный старт занял {elapsed:.2f} с - больше бюджета {STARTUP_BUDGET:.2f} с")
+    else:
+        logger.info(f"Холодный старт: {elapsed:.2f} с (бюджет {STARTUP_BUDGET:.2f} с)")
+    return elapsed
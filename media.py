@@ -0,0 +1,110 @@
+import os
+import json
+import logging
+
+from telegram import InputMediaPhoto
+from telegram.error import BadRequest
+
+
+# file_id картинок, уже загруженных в Telegram: повторно картинка отправляется по id, без загрузки
+MEDIA_IDS_PATH = os.environ.get('FA_MEDIA_IDS_PATH', 'media_ids.json')
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+INSTRUCTION = ['images/inst1.jpg', 'images/inst2.jpg', 'images/inst3.jpg']
+
+logger = logging.getLogger(__name__)
+
+_ids = None
+
+
+def _signature(path):
+    # Замененная картинка (другой размер или время изменения) загружается заново
+    stat = os.stat(path)
+    return f'{stat.st_size}:{int(stat.st_mtime)}'
+
+
+def _resolve(path):
+    return path if os.path.isabs(path) or os.path.exists(path) else os.path.join(BASE_DIR, path)
+
+
+def _load():
+    global _ids
+    if _ids is None:
+        try:
+            with open(MEDIA_IDS_PATH, encoding='utf-8') as file:
+                _ids = json.load(file)
+        except (OSError, ValueError):
+            _ids = {}
+    return _ids
+
+
+def _save():
+    temporary = f'{MEDIA_IDS_PATH}.tmp'
+    with open(temporary, 'w', encoding='utf-8') as file:
+        json.dump(_ids, file, ensure_ascii=False, indent=1)
+    os.replace(temporary, MEDIA_IDS_PATH)
+
+
+def _known_ids(bot_id):
+    # id файлов действительны только для того бота, который их получил
+    return _load().setdefault(str(bot_id), {})
+
+
+def file_id(bot_id, path):
+    entry = _known_ids(bot_id).get(path)
+    if entry and entry['signature'] == _signature(_resolve(path)):
+        return entry['file_id']
+    return None
+
+
+def forget(bot_id, paths):
+    known = _known_ids(bot_id)
+    for path in paths:
+        known.pop(path, None)
+    _save()
+
+
+def remember(bot_id, paths, messages):
+    known = _known_ids(bot_id)
+    for path, message in zip(paths, messages):
+        if message.photo:
+            # Самый большой размер - исходное качество картинки
+            known[path] = {'file_id': message.photo[-1].file_id, 'signature': _signature(_resolve(path))}
+    _save()
+
+
+def _read(path):
+    with open(_resolve(path), 'rb') as file:
+        return file.read()
+
+
+def _album(bot_id, paths, caption, parse_mode, use_ids=True):
+    album = []
+    for index, path in enumerate(paths):
+        media = file_id(bot_id, path) if use_ids else None
+        extra = {'caption': caption, 'parse_mode': parse_mode} if index == 0 and caption else {}
+        album.append(InputMediaPhoto(media or _read(path), **extra))
+    return album
+
+
+async def send_album(message, paths, caption=None, parse_mode=None):
+    # Альбом картинок ответом на message: по сохраненным file_id, а если Telegram их не принял -
+    # загрузкой файлов заново. Возвращает отправленные сообщения
+    bot_id = message.get_bot().id
+    with_ids = any(file_id(bot_id, path) for path in paths)
+    try:
+        sent = await message.reply_media_group(media=_album(bot_id, paths, caption, parse_mode))
+    except BadRequest as e:
+        if not with_ids:
+            raise
+        logger.warning(f"Telegram не принял сохраненные file_id, загружаем картинки заново: {e}")
+        forget(bot_id, paths)
+        sent = await message.reply_media_group(media=_album(bot_id, paths, caption, parse_mode, use_ids=False))
+
+    if any(file_id(bot_id, path) is None for path in paths):
+        try:
+            remember(bot_id, paths, sent)
+        except OSError as e:
+            logger.error(f"Не удалось сохранить file_id картинок: {e}")
+    return sent
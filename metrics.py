@@ -0,0 +1,267 @@
+import os
+import time
+import bisect
+import inspect
+import functools
+import threading
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+
+# Файл с метриками в текстовом формате Prometheus (его читает node_exporter или другой сборщик)
+METRICS_PATH = os.environ.get('FA_METRICS_PATH', 'metrics.prom')
+
+# Окно скользящей статистики для /stats в секундах и интервал записи файла метрик
+METRICS_WINDOW = int(os.environ.get('FA_METRICS_WINDOW', 3600))
+METRICS_FLUSH = float(os.environ.get('FA_METRICS_FLUSH', 10))
+
+# Память этапа - насколько выросла память процесса за время этапа.
+# 1 - точно через tracemalloc: пик выделенной Python памяти минус занятая на старте (заметно замедляет вычисления;
+#     только в рабочих процессах и пакетной обработке, см. trace_memory),
+# 0 - по размеру процесса (RSS) в конце и в начале этапа, почти ничего не стоит, но не видит уже освобожденную память
+TRACE_MEMORY = int(os.environ.get('FA_METRICS_TRACE_MEMORY', 0))
+
+# Пользователи Telegram, которым доступна команда /stats
+ADMIN_IDS = {int(value) for value in os.environ.get('FA_ADMIN_IDS', '').replace(',', ' ').split()}
+
+# Границы корзин гистограммы задержек в секундах
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_lock = threading.Lock()
+_stages = {}
+_pending = []
+_forward = False
+_last_flush = 0.0
+_local = threading.local()
+
+
+class StageStats:
+    # Накопленная гистограмма (для сборщика) и скользящее окно последних замеров (для /stats)
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.size_total = 0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.window = deque()
+
+    def add(self, seconds, size, memory, moment):
+        self.count += 1
+        self.total += seconds
+        self.size_total += size or 0
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.window.append((moment, seconds, size, memory))
+
+    def trim(self, now):
+        while self.window and now - self.window[0][0] > METRICS_WINDOW:
+            self.window.popleft()
+
+    def summary(self):
+        durations = sorted(seconds for _, seconds, _, _ in self.window)
+        sizes = [size for _, _, size, _ in self.window if size is not None]
+        memory = [value for _, _, _, value in self.window if value is not None]
+        if not durations:
+            return None
+        return {
+            'count': len(durations),
+            'p50': durations[len(durations) // 2],
+            'p95': durations[min(len(durations) - 1, int(len(durations) * 0.95))],
+            'max': durations[-1],
+            'size': sum(sizes) / len(sizes) if sizes else None,
+            'memory': max(memory) if memory else None,
+        }
+
+
+def _current_rss():
+    # Текущий размер процесса в байтах. ru_maxrss не подходит: это пик за всю жизнь процесса,
+    # он только растет и одинаков у всех этапов. /proc есть только на Linux, на других системах - None
+    try:
+        with open('/proc/self/statm', 'rb') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def input_size(args):
+    # Размер входа: число строк таблицы или длина файла в байтах
+    for value in args:
+        if hasattr(value, 'shape'):
+            return int(value.shape[0])
+        if isinstance(value, (bytes, bytearray)):
+            return len(value)
+    return None
+
+
+def record(stage, seconds, size=None, memory=None):
+    moment = time.time()
+    with _lock:
+        if _forward:
+            # В рабочем процессе замеры копятся до конца задачи и уходят в процесс бота вместе с результатом
+            _pending.append((stage, seconds, size, memory, moment))
+            return
+        stats = _stages.setdefault(stage, StageStats())
+        stats.add(seconds, size, memory, moment)
+        stats.trim(moment)
+    maybe_flush()
+
+
+def ingest(records):
+    # Замеры, пришедшие из рабочих процессов
+    for stage, seconds, size, memory, moment in records:
+        with _lock:
+            stats = _stages.setdefault(stage, StageStats())
+            stats.add(seconds, size, memory, moment)
+            stats.trim(moment)
+    maybe_flush()
+
+
+def forward():
+    # Включается в рабочих процессах пула
+    global _forward
+    _forward = True
+    trace_memory()
+
+
+def trace_memory():
+    # tracemalloc включается только там, где этапы выполняются строго по одному: в рабочих процессах пула
+    # и в пакетной обработке. Пик у tracemalloc один на процесс, а в процессе бота параллельные обработчики
+    # (concurrent_updates) сбрасывали бы его друг другу - там память этапов считается по RSS
+    if TRACE_MEMORY and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def drain():
+    with _lock:
+        records = list(_pending)
+        _pending.clear()
+    return records
+
+
+@contextmanager
+def stage(name, size=None):
+    # Замер одного этапа: время, размер входа и прирост памяти
+    tracing = TRACE_MEMORY and tracemalloc.is_tracing()
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    if tracing:
+        # Пик вложенного этапа сбрасывает общий счетчик, поэтому родителю передаем максимум вложенных
+        used, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1] = max(stack[-1], peak)
+        tracemalloc.reset_peak()
+        stack.append(0)
+    else:
+        used = _current_rss()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        if tracing:
+            peak = max(stack.pop(), tracemalloc.get_traced_memory()[1])
+            if stack:
+                stack[-1] = max(stack[-1], peak)
+            memory = peak - used
+        else:
+            # В процессе бота параллельные обработчики тоже меняют размер процесса - там это оценка
+            current = _current_rss()
+            memory = max(0, current - used) if current is not None and used is not None else None
+        record(name, seconds, size, memory)
+
+
+def timed(name):
+    # Декоратор: замер функции как этапа; размер входа берется из первого подходящего аргумента
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name, input_size(args)):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name, input_size(args)):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def snapshot():
+    now = time.time()
+    with _lock:
+        for stats in _stages.values():
+            stats.trim(now)
+        return {name: stats.summary() for name, stats in _stages.items()}
+
+
+def report(limit=30):
+    # Текст для /stats: самые долгие этапы за окно, время в миллисекундах
+    rows = [(name, summary) for name, summary in snapshot().items() if summary]
+    rows.sort(key=lambda row: -row[1]['p95'])
+    if not rows:
+        return 'Замеров пока нет'
+    lines = [f"За последние {METRICS_WINDOW // 60} мин.",
+             f"{'этап':<32} {'n':>5} {'p50':>7} {'p95':>7} {'max':>7} {'вход':>9} {'+МБ':>7}"]
+    for name, summary in rows[:limit]:
+        size = f"{summary['size']:.0f}" if summary['size'] is not None else '-'
+        memory = f"{summary['memory'] / 1024 / 1024:.1f}" if summary['memory'] is not None else '-'
+        lines.append(f"{name[:32]:<32} {summary['count']:>5} {summary['p50'] * 1000:>7.0f} "
+                     f"{summary['p95'] * 1000:>7.0f} {summary['max'] * 1000:>7.0f} {size:>9} {memory:>7}")
+    return '\n'.join(lines)
+
+
+def exposition():
+    # Текстовый формат Prometheus: гистограмма задержек, суммарный размер входа и прирост памяти по этапам
+    lines = ['# HELP fa_stage_seconds Время выполнения этапа',
+             '# TYPE fa_stage_seconds histogram']
+    with _lock:
+        stages = {name: (stats.count, stats.total, stats.size_total, list(stats.buckets),
+                         max((memory for *_, memory in stats.window if memory is not None), default=None))
+                  for name, stats in _stages.items()}
+    for name, (count, total, _, buckets, _) in sorted(stages.items()):
+        cumulative = 0
+        for bound, bucket in zip(BUCKETS + ('+Inf',), buckets):
+            cumulative += bucket
+            lines.append(f'fa_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+        lines.append(f'fa_stage_seconds_sum{{stage="{name}"}} {total:.6f}')
+        lines.append(f'fa_stage_seconds_count{{stage="{name}"}} {count}')
+
+    lines += ['# HELP fa_stage_input_size_total Суммарный размер входа этапа (строки или байты)',
+              '# TYPE fa_stage_input_size_total counter']
+    lines += [f'fa_stage_input_size_total{{stage="{name}"}} {size}' for name, (_, _, size, _, _) in sorted(stages.items())]
+
+    lines += ['# HELP fa_stage_memory_growth_bytes Наибольший прирост памяти процесса за этап за окно',
+              '# TYPE fa_stage_memory_growth_bytes gauge']
+    lines += [f'fa_stage_memory_growth_bytes{{stage="{name}"}} {memory}'
+              for name, (*_, memory) in sorted(stages.items()) if memory is not None]
+    return '\n'.join(lines) + '\n'
+
+
+def write(path=None):
+    # Запись через временный файл: сборщик никогда не увидит файл наполовину
+    path = path or METRICS_PATH
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w', encoding='utf-8') as file:
+        file.write(exposition())
+    os.replace(temporary, path)
+
+
+def maybe_flush():
+    global _last_flush
+    if not METRICS_PATH:
+        return
+    now = time.monotonic()
+    with _lock:
+        if now - _last_flush < METRICS_FLUSH:
+            return
+        _last_flush = now
+    try:
+        write()
+    except OSError:
+        pass
+
+
+def is_admin(user_id):
+    return user_id in ADMIN_IDS
@@ -0,0 +1,127 @@
+import os
+import re
+from functools import lru_cache
+from datetime import datetime
+
+from dateutil.relativedelta import relativedelta
+
+
+# Сколько разобранных фраз держать в памяти
+PERIOD_CACHE_SIZE = int(os.environ.get('FA_PERIOD_CACHE_SIZE', 1024))
+
+MONTHS = {
+    'янв': 1, 'фев': 2, 'мар': 3, 'апр': 4, 'мая': 5, 'май': 5, 'мае': 5, 'июн': 6,
+    'июл': 7, 'авг': 8, 'сен': 9, 'окт': 10, 'ноя': 11, 'дек': 12,
+}
+
+UNITS = {'д': 'days', 'н': 'weeks', 'м': 'months', 'г': 'years', 'л': 'years'}
+
+DATE = r"\d{1,2}[./]\d{1,2}[./](?:\d{4}|\d{2})"
+
+# Быстрый разбор частых русских формулировок - скомпилированные выражения вместо dateparser
+RELATIVE_RE = re.compile(r"последн\w*\s+(?:(\d+)\s+)?(дн\w*|день|недел\w*|месяц\w*|год\w*|лет)\b")
+SEASON_RE = re.compile(r"(весна|весну|весной|лето|летом|осень|осенью|зима|зиму|зимой)\s(\d{4})")
+MONTH_RE = re.compile(r"\b(янв|фев|мар|апр|ма[йяе]|июн|июл|авг|сен|окт|ноя|дек)[а-я]*\s(\d{4})")
+RANGE_RES = [
+    re.compile(rf"с ({DATE}) по ({DATE})"),
+    re.compile(rf"({DATE})\s?-\s?({DATE})"),
+]
+YEAR_RE = re.compile(r"(?:за\s)?(\d{4})(?:\s?(?:г|г\.|год\w*))?")
+
+
+def normalize(text: str):
+    return re.sub(r"\s+", " ", text.strip().lower().replace('ё', 'е'))
+
+
+def get_season_dates(year: int, season: str):
+    seasons = {
+        "весна": (datetime(year, 3, 1), datetime(year, 5, 31)),
+        "лето": (datetime(year, 6, 1), datetime(year, 8, 31)),
+        "осень": (datetime(year, 9, 1), datetime(year, 11, 30)),
+        "зима": (datetime(year, 12, 1), datetime(year + 1, 2, 28))
+    }
+    return seasons.get(season.lower())
+
+
+def month_dates(year: int, month: int):
+    start_date = datetime(year, month, 1)
+    return start_date, start_date + relativedelta(months=1) - relativedelta(days=1)
+
+
+def parse_date(text: str):
+    # Даты вида 01.02.2024 или 01/02/24 - день всегда первым, как пишут по-русски
+    day, month, year = re.split(r"[./]", text)
+    year = int(year) + 2000 if len(year) == 2 else int(year)
+    try:
+        return datetime(year, int(month), int(day))
+    except ValueError:
+        return None
+
+
+def parse_relative(text: str, now: datetime):
+    # "последний месяц", "последние 3 месяца", "последние 10 дней" - считаются от текущего момента, не кэшируются
+    match = RELATIVE_RE.search(text)
+    if not match:
+        return None
+    count, unit = match.groups()
+    return now - relativedelta(**{UNITS[unit[0]]: int(count or 1)}), now
+
+
+def parse_fast(text: str):
+    season_match = SEASON_RE.search(text)
+    if season_match:
+        season, year = season_match.groups()
+        season = {'весну': 'весна', 'весной': 'весна', 'летом': 'лето', 'осенью': 'осень',
+                  'зиму': 'зима', 'зимой': 'зима'}.get(season, season)
+        return get_season_dates(int(year), season)
+
+    month_match = MONTH_RE.search(text)
+    if month_match:
+        month, year = month_match.groups()
+        return month_dates(int(year), MONTHS[month])
+
+    for pattern in RANGE_RES:
+        match = pattern.search(text)
+        if match:
+            start_date, end_date = (parse_date(value) for value in match.groups())
+            if start_date and end_date:
+                return start_date, end_date
+
+    year_match = YEAR_RE.fullmatch(text)
+    if year_match:
+        year = int(year_match.group(1))
+        return datetime(year, 1, 1), datetime(year, 12, 31)
+
+    return None
+
+
+def parse_slow(text: str):
+    # Последний шанс - dateparser. Импортируется только здесь: загрузка его языковых данных занимает секунды
+    from dateparser import parse
+    from dateparser.search import search_dates
+
+    month_year_match = re.search(r"(\w+)\s(\d{4})", text)
+    if month_year_match:
+        month_name, year = month_year_match.groups()
+        month_date = parse(f"01 {month_name} {year}", settings={'DATE_ORDER': 'DMY'})
+        if month_date:
+            return month_date, month_date + relativedelta(months=1) - relativedelta(days=1)
+
+    parsed_dates = search_dates(text, settings={'PREFER_DATES_FROM': 'past'})
+
+    if parsed_dates and len(parsed_dates) >= 2:
+        return parsed_dates[0][1], parsed_dates[-1][1]
+
+    return None, None
+
+
+@lru_cache(maxsize=PERIOD_CACHE_SIZE)
+def parse_cached(text: str, today):
+    # today входит в ключ: ответ dateparser для фраз вроде "в марте" зависит от текущей даты
+    return parse_fast(text) or parse_slow(text)
+
+
+def parse_period(text: str, now=None):
+    now = now or datetime.now()
+    text = normalize(text)
+    return parse_relative(text, now) or parse_cached(text, now.date())
@@ -0,0 +1,106 @@
+import os
+import pickle
+import sqlite3
+import asyncio
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+
+# Общее для всех процессов бота хранилище context.user_data (состояние диалога: ожидаемый ввод, периоды, id сообщений)
+STATE_DB_PATH = os.environ.get('FA_STATE_DB_PATH', 'state.db')
+
+# Как часто (в секундах) изменения user_data записываются в базу
+PERSISTENCE_INTERVAL = float(os.environ.get('FA_PERSISTENCE_INTERVAL', 5))
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS user_data (
+    user_id INTEGER PRIMARY KEY,
+    data BLOB NOT NULL
+);
+'''
+
+
+class SqlitePersistence(BasePersistence):
+    # user_data в SQLite: несколько процессов бота работают с одним файлом, каждый пишет только
+    # своих пользователей (обновления распределяются по процессам по chat_id, см. cluster.py).
+    # chat_data, bot_data и callback_data бот не использует и не хранит
+
+    def __init__(self, path=STATE_DB_PATH, update_interval=PERSISTENCE_INTERVAL):
+        super().__init__(store_data=PersistenceInput(bot_data=False, chat_data=False, callback_data=False),
+                         update_interval=update_interval)
+        self.path = path
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            # Соединение используется из потоков asyncio.to_thread, но не одновременно (см. _lock)
+            self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.executescript(SCHEMA)
+            self._lock = asyncio.Lock()
+        return self._connection
+
+    async def _run(self, func, *args):
+        connection = self._connect()
+        async with self._lock:
+            return await asyncio.to_thread(func, connection, *args)
+
+    async def get_user_data(self):
+        def load(connection):
+            rows = connection.execute('SELECT user_id, data FROM user_data').fetchall()
+            return {user_id: pickle.loads(data) for user_id, data in rows}
+        return await self._run(load)
+
+    async def update_user_data(self, user_id, data):
+        def save(connection, blob):
+            with connection:
+                connection.execute('INSERT OR REPLACE INTO user_data (user_id, data) VALUES (?, ?)', (user_id, blob))
+        await self._run(save, pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+
+    async def drop_user_data(self, user_id):
+        def drop(connection):
+            with connection:
+                connection.execute('DELETE FROM user_data WHERE user_id = ?', (user_id,))
+        await self._run(drop)
+
+    async def refresh_user_data(self, user_id, user_data):
+        # Данные пользователя меняет только его процесс, в памяти они всегда новее, чем в базе
+        pass
+
+    async def get_chat_data(self):
+        return {}
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def get_bot_data(self):
+        return {}
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def update_conversation(self, name, key, new_state):
+        pass
+
+    async def flush(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
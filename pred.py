@@ -8,17 +8,274 @@ import matplotlib.pyplot as plt
 import pandas as pd
 from matplotlib import rcParams
 import seaborn as sns
+import os
+import render
+import metrics
+import pickle
+import hashlib
+from collections import OrderedDict
+from joblib import Parallel, delayed
 
 # Подавление предупреждений
 warnings.filterwarnings("ignore")
 
+# Число процессов для обучения моделей по категориям (-1 - все ядра, 1 - последовательно)
+FORECAST_JOBS = int(os.environ.get('FA_FORECAST_JOBS', 1))
+
+# Ограничения кэша обученных моделей
+MODEL_CACHE_ENTRIES = int(os.environ.get('FA_MODEL_CACHE_ENTRIES', 2048))
+MODEL_CACHE_MB = int(os.environ.get('FA_MODEL_CACHE_MB', 256))
+
+# Сколько новых месяцев модель может получить обновлением, прежде чем ее параметры будут переобучены
+MODEL_UPDATE_MONTHS = int(os.environ.get('FA_MODEL_UPDATE_MONTHS', 6))
+
+# Движок прогноза: 'arima' - модели statsmodels по каждой категории, 'fast' - векторное
+# экспоненциальное сглаживание сразу по всем категориям, 'auto' - выбор по длине ряда
+FORECAST_ENGINE = os.environ.get('FA_FORECAST_ENGINE', 'auto')
+ENGINES = ('arima', 'fast', 'auto')
+
+# В режиме auto ряды короче этого числа месяцев прогнозируются сглаживанием: сезонной SARIMAX
+# нужно хотя бы два полных года, на более коротких рядах она неустойчива и в десятки раз медленнее
+AUTO_ARIMA_MONTHS = int(os.environ.get('FA_AUTO_ARIMA_MONTHS', 24))
+
+# Сетка параметров сглаживания с затухающим трендом: уровень (alpha), тренд (beta), затухание (phi)
+SMOOTHING_GRID = np.array([(alpha, beta, phi)
+                           for alpha in (0.05, 0.1, 0.2, 0.3, 0.5)
+                           for beta in (0.0, 0.05, 0.1)
+                           for phi in (0.8, 0.9)])
+
 
 def scale_data(time_series):
     scaler = MinMaxScaler()
     scaled_data = scaler.fit_transform(time_series.values.reshape(-1, 1))
     return scaler, scaled_data
 
-def forecast_spending_with_scaling(data, months_to_forecast):
+def model_order(length):
+    # Вид модели зависит только от длины ряда
+    if length >= 12:
+        return 'sarimax'
+    elif length >= 6:
+        return (1, 1, 1)
+    return (0, 1, 1)
+
+def fit_model(time_series):
+    # Масштабирование данных
+    scaler, scaled_data = scale_data(time_series)
+    time_series_scaled = pd.Series(scaled_data.flatten(), index=time_series.index)
+
+    # Выбор модели в зависимости от объема данных
+    order = model_order(len(time_series_scaled))
+    if order == 'sarimax':
+        model = SARIMAX(time_series_scaled, 
+                        order=(1, 1, 1), 
+                        seasonal_order=(1, 1, 1, 12), 
+                        enforce_stationarity=False, 
+                        enforce_invertibility=False)
+    else:
+        model = ARIMA(time_series_scaled, order=order)
+
+    # low_memory: результаты сглаживания для прогноза не нужны, а кэшированная модель занимает в разы меньше памяти
+    fitted_model = model.fit(low_memory=True)
+    return scaler, fitted_model
+
+def fit_category(time_series):
+    # Ошибка в одной категории не должна ронять прогноз по остальным
+    try:
+        return fit_model(time_series)
+    except Exception as e:
+        return None
+
+def update_model(state, time_series):
+    # Обновление обученной модели новым рядом без обучения: параметры остаются прежними, фильтр Калмана
+    # пересчитывается по новым данным (как append/apply в statsmodels, но с low_memory).
+    # Возвращает None, если нужно полноценное переобучение: сменился вид модели, новые значения
+    # выходят за диапазон масштабирования или с последнего обучения прибавилось слишком много месяцев
+    if state['model'] is None:
+        return None
+    scaler, fitted_model = state['model']
+    values = time_series.to_numpy(dtype='float64')
+
+    if model_order(len(values)) != model_order(len(state['values'])):
+        return None
+    if len(values) - state['fitted_on'] > MODEL_UPDATE_MONTHS:
+        return None
+    if values.min() < scaler.data_min_[0] or values.max() > scaler.data_max_[0]:
+        return None
+
+    time_series_scaled = pd.Series(scaler.transform(values.reshape(-1, 1)).flatten(), index=time_series.index)
+    try:
+        # cov_type='none': ковариация параметров (численный гессиан) для прогноза среднего не нужна
+        updated_model = fitted_model.model.clone(time_series_scaled)
+        return scaler, updated_model.filter(fitted_model.params, low_memory=True, cov_type='none')
+    except Exception as e:
+        return None
+
+def forecast_from_model(scaler, fitted_model, months_to_forecast):
+    # Прогноз на любой горизонт по уже обученной модели - без повторного обучения
+    forecast = fitted_model.get_forecast(steps=months_to_forecast)
+    forecasted_sum_scaled = forecast.predicted_mean.sum()
+    forecasted_sum = scaler.inverse_transform([[forecasted_sum_scaled]])[0][0]
+    return max(0, forecasted_sum)
+
+
+class ModelCache:
+    # LRU-кэш обученных моделей с ограничением по числу записей и по памяти.
+    # Ключ - (владелец, категория), где владелец - пользователь или отпечаток его помесячных данных;
+    # значение - ряд, на котором построена модель, сама модель и длина ряда при последнем обучении.
+
+    def __init__(self, max_entries=MODEL_CACHE_ENTRIES, max_bytes=MODEL_CACHE_MB * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key):
+        if key not in self._items:
+            return None
+        self._items.move_to_end(key)
+        return self._items[key][0]
+
+    def put(self, key, value):
+        # Размер модели оцениваем по её сериализованному виду
+        size = len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        if size > self.max_bytes:
+            return
+        if key in self._items:
+            self.total_bytes -= self._items.pop(key)[1]
+        self._items[key] = (value, size)
+        self.total_bytes += size
+        while len(self._items) > self.max_entries or self.total_bytes > self.max_bytes:
+            _, (_, old_size) = self._items.popitem(last=False)
+            self.total_bytes -= old_size
+
+    def clear(self):
+        self._items.clear()
+        self.total_bytes = 0
+
+
+model_cache = ModelCache()
+
+# Сколько раз модель взята из кэша как есть, обновлена новыми месяцами и обучена заново
+model_stats = {'reused': 0, 'updated': 0, 'fitted': 0}
+
+
+def data_fingerprint(monthly_data):
+    hashes = pd.util.hash_pandas_object(monthly_data, index=False).values
+    return hashlib.sha1(hashes.tobytes()).hexdigest()
+
+def monthly_matrix(series_list):
+    # Матрица (категория x месяц): наблюдения каждой категории прижаты к правому краю, слева - NaN.
+    # Ряд содержит только месяцы с тратами - как и ряды, на которых обучается ARIMA
+    width = max(len(time_series) for _, time_series in series_list)
+    matrix = np.full((len(series_list), width), np.nan)
+    for row, (_, time_series) in enumerate(series_list):
+        matrix[row, width - len(time_series):] = time_series.to_numpy(dtype='float64')
+    return matrix
+
+
+def smoothing_forecast(matrix, months_to_forecast, grid=SMOOTHING_GRID):
+    # Сглаживание с затухающим трендом для всех категорий и всех параметров сетки одновременно:
+    # состояния имеют форму (параметры x категории), цикл идет только по месяцам
+    alpha, beta, phi = (grid[:, i:i + 1] for i in range(3))
+    shape = (len(grid), matrix.shape[0])
+    level = np.zeros(shape)
+    trend = np.zeros(shape)
+    sse = np.zeros(shape)
+    started = np.zeros(matrix.shape[0], dtype=bool)
+
+    for values in matrix.T:
+        observed = ~np.isnan(values)
+        update = observed & started
+        # Первое наблюдение задает начальный уровень, тренд начинается с нуля
+        first = observed & ~started
+        level = np.where(first, values, level)
+
+        predicted = level + phi * trend
+        error = np.where(update, values - predicted, 0.0)
+        sse += error ** 2
+        level = np.where(update, predicted + alpha * error, level)
+        trend = np.where(update, phi * trend + alpha * beta * error, trend)
+        started |= observed
+
+    # Для каждой категории - параметры с наименьшей ошибкой прогноза на шаг вперед
+    best = sse.argmin(axis=0)
+    columns = np.arange(matrix.shape[0])
+    level, trend, phi = level[best, columns], trend[best, columns], grid[best, 2]
+
+    # Сумма прогноза на h месяцев: h * уровень + тренд * сумма по k от 1 до h (phi + ... + phi^k)
+    powers = phi[:, None] ** np.arange(1, months_to_forecast + 1)
+    damping = np.cumsum(powers, axis=1).sum(axis=1)
+    return np.maximum(0, months_to_forecast * level + damping * trend)
+
+
+def arima_forecasts(monthly_data, series_list, months_to_forecast, n_jobs=FORECAST_JOBS, owner=None):
+    # Прогноз моделями statsmodels по каждой категории. Модели хранятся в кэше по владельцу:
+    # если у пользователя появились новые месяцы, модель обновляется, а не обучается с нуля
+    if owner is None:
+        owner = data_fingerprint(monthly_data)
+    models = {}
+    to_fit = []
+    for category, time_series in series_list:
+        state = model_cache.get((owner, category))
+        values = time_series.to_numpy(dtype='float64')
+        if state is not None and np.array_equal(state['values'], values):
+            models[category] = state['model']
+            model_stats['reused'] += 1
+            continue
+
+        updated = update_model(state, time_series) if state is not None else None
+        if updated is None:
+            to_fit.append((category, time_series))
+            continue
+        models[category] = updated
+        model_stats['updated'] += 1
+        model_cache.put((owner, category), {'values': values, 'model': updated, 'fitted_on': state['fitted_on']})
+
+    if n_jobs == 1 or len(to_fit) < 2:
+        fitted = [fit_category(time_series) for category, time_series in to_fit]
+    else:
+        # Parallel возвращает результаты в порядке входного списка, поэтому порядок строк не зависит от числа процессов
+        fitted = Parallel(n_jobs=n_jobs)(delayed(fit_category)(time_series) for category, time_series in to_fit)
+
+    # Неудачное обучение тоже кэшируется (как None), чтобы не повторять его на каждом запросе
+    for (category, time_series), model in zip(to_fit, fitted):
+        models[category] = model
+        model_stats['fitted'] += 1
+        model_cache.put((owner, category), {'values': time_series.to_numpy(dtype='float64'), 'model': model,
+                                            'fitted_on': len(time_series)})
+
+    forecasts = {}
+    for category, time_series in series_list:
+        model = models[category]
+        if model is None:
+            continue
+        try:
+            scaler, fitted_model = model
+            forecasts[category] = forecast_from_model(scaler, fitted_model, months_to_forecast)
+        except Exception as e:
+            continue
+    return forecasts
+
+
+def fast_forecasts(series_list, months_to_forecast):
+    if not series_list:
+        return {}
+    sums = smoothing_forecast(monthly_matrix(series_list), months_to_forecast)
+    return {category: forecasted_sum for (category, _), forecasted_sum in zip(series_list, sums)}
+
+
+@metrics.timed('pred.forecast_spending_with_scaling')
+def forecast_spending_with_scaling(data, months_to_forecast, n_jobs=FORECAST_JOBS, engine=None, owner=None):
+    engine = engine or FORECAST_ENGINE
+    if engine not in ENGINES:
+        raise ValueError(f"Неизвестный движок прогноза: {engine}")
+
     data = data.copy()
     df = data.rename(columns={'Дата операции':'date', 'Траты':'amount', 'Кэшбэк':'cashback', 'Категория':'category'})
 
@@ -33,9 +290,11 @@ def forecast_spending_with_scaling(data, months_to_forecast):
 
     df['year_month'] = df['date'].dt.to_period('M')
     monthly_data = df.groupby(['year_month', 'category']).agg({'amount': 'sum'}).reset_index()
+    # Суммы округляем до копеек: иначе погрешность сложения (операции или куб) меняет обучение модели
+    monthly_data['amount'] = monthly_data['amount'].round(2)
 
     categories = monthly_data['category'].unique()
-    forecasted_results = []
+    series_list = []
 
     for category in categories:
         category_data = monthly_data[monthly_data['category'] == category]
@@ -44,33 +303,22 @@ def forecast_spending_with_scaling(data, months_to_forecast):
         if len(time_series) < 3:
             continue
 
-        try:
-            # Масштабирование данных
-            scaler, scaled_data = scale_data(time_series)
-            time_series_scaled = pd.Series(scaled_data.flatten(), index=time_series.index)
-
-            # Выбор модели в зависимости от объема данных
-            if len(time_series_scaled) >= 12:
-                model = SARIMAX(time_series_scaled, 
-                                order=(1, 1, 1), 
-                                seasonal_order=(1, 1, 1, 12), 
-                                enforce_stationarity=False, 
-                                enforce_invertibility=False)
-            elif len(time_series_scaled) >= 6:
-                model = ARIMA(time_series_scaled, order=(1, 1, 1))
-            else:
-                model = ARIMA(time_series_scaled, order=(0, 1, 1))
-
-            # Финальный прогноз
-            fitted_model = model.fit()
-            forecast = fitted_model.get_forecast(steps=months_to_forecast)
-            forecasted_sum_scaled = forecast.predicted_mean.sum()
-            forecasted_sum = scaler.inverse_transform([[forecasted_sum_scaled]])[0][0]
-            forecasted_sum = max(0, forecasted_sum)
-
-            forecasted_results.append({'category': category, 'forecasted_amount': forecasted_sum})
-        except Exception as e:
-            continue
+        series_list.append((category, time_series))
+
+    if engine == 'arima':
+        arima_list, fast_list = series_list, []
+    elif engine == 'fast':
+        arima_list, fast_list = [], series_list
+    else:
+        arima_list = [item for item in series_list if len(item[1]) >= AUTO_ARIMA_MONTHS]
+        fast_list = [item for item in series_list if len(item[1]) < AUTO_ARIMA_MONTHS]
+
+    forecasts = fast_forecasts(fast_list, months_to_forecast)
+    if arima_list:
+        forecasts.update(arima_forecasts(monthly_data, arima_list, months_to_forecast, n_jobs, owner))
+
+    forecasted_results = [{'category': category, 'forecasted_amount': forecasts[category]}
+                          for category, _ in series_list if category in forecasts]
 
     result_df = pd.DataFrame(forecasted_results)
     return result_df
@@ -81,9 +329,10 @@ def forecast_spending_with_scaling(data, months_to_forecast):
 # In[77]:
 
 
-def pred_spend(data, month, f1):
+@metrics.timed('pred.pred_spend')
+def pred_spend(data, month, f1=None, n_jobs=FORECAST_JOBS, engine=None, owner=None):
     data = data.copy()
-    data = forecast_spending_with_scaling(data, month)
+    data = forecast_spending_with_scaling(data, month, n_jobs=n_jobs, engine=engine, owner=owner)
     data = data[data['forecasted_amount'] > 50]
 
     # Если категорий больше 15, оставляем только топ-15 по прогнозируемым тратам
@@ -93,46 +342,43 @@ def pred_spend(data, month, f1):
     # Сортировка данных по убыванию для лучшей читаемости диаграммы
     data = data.sort_values(by='forecasted_amount', ascending=True)
 
-    # Установка шрифта
-    rcParams['font.family'] = 'DejaVu Sans'
-    rcParams['font.size'] = 12
-
     # Построение горизонтальной гистограммы
-    fig, ax = plt.subplots(figsize=(12, 8))
-    colors = sns.color_palette("pink_r", len(data))
+    with render.figure(figsize=(12, 8)) as fig:
+        ax = fig.subplots()
+        colors = sns.color_palette("pink_r", len(data))
 
-    bars = ax.barh(data['category'], data['forecasted_amount'], color=colors)
+        bars = ax.barh(data['category'], data['forecasted_amount'], color=colors)
 
-    # Добавление значений на столбцы
-    for bar in bars:
-        xval = bar.get_width()
-        ax.text(xval + 5, bar.get_y() + bar.get_height()/2, int(xval), 
-                ha='left', va='center', fontsize=12, color='black', fontweight='bold')
+        # Добавление значений на столбцы
+        for bar in bars:
+            xval = bar.get_width()
+            ax.text(xval + 5, bar.get_y() + bar.get_height()/2, int(xval), 
+                    ha='left', va='center', fontsize=12, color='black', fontweight='bold')
 
-    # Добавление сетки
-    ax.grid(True, axis='x', linestyle='--', alpha=0.7)
+        # Добавление сетки
+        ax.grid(True, axis='x', linestyle='--', alpha=0.7)
 
-    # Добавление заголовка
-    ax.set_title('Прогноз трат', fontsize=20, fontweight='bold', color='black', pad=20)
+        # Добавление заголовка
+        ax.set_title('Прогноз трат', fontsize=20, fontweight='bold', color='black', pad=20)
 
-    # Настройка осей
-    ax.set_xlabel('Сумма (в рублях)', fontsize=14, fontweight='bold', color='#49423d', labelpad=15)
-    ax.set_ylabel('Категория', fontsize=14, fontweight='bold', color='#49423d', labelpad=15)
+        # Настройка осей
+        ax.set_xlabel('Сумма (в рублях)', fontsize=14, fontweight='bold', color='#49423d', labelpad=15)
+        ax.set_ylabel('Категория', fontsize=14, fontweight='bold', color='#49423d', labelpad=15)
 
-    # Настройка внешнего вида осей
-    ax.tick_params(axis='x', colors='gray', labelsize=12)
-    ax.tick_params(axis='y', colors='gray', labelsize=12)
+        # Настройка внешнего вида осей
+        ax.tick_params(axis='x', colors='gray', labelsize=12)
+        ax.tick_params(axis='y', colors='gray', labelsize=12)
 
-    # Отключение верхней и правой рамок
-    sns.despine(left=True, bottom=True)
+        # Отключение верхней и правой рамок
+        sns.despine(ax=ax, left=True, bottom=True)
 
-    # Добавление пояснения внизу диаграммы
-    if len(data) == 15:
-        ax.text(0.5, -0.1, '\n\n\nВ остальных категориях траты минимальны', 
-                ha='center', va='center', transform=ax.transAxes, 
-                fontsize=15, color='#878787')
+        # Добавление пояснения внизу диаграммы
+        if len(data) == 15:
+            ax.text(0.5, -0.1, '\n\n\nВ остальных категориях траты минимальны', 
+                    ha='center', va='center', transform=ax.transAxes, 
+                    fontsize=15, color='#878787')
 
-    # Сохранение изображения
-    plt.savefig(f1, bbox_inches='tight', dpi=300)
+        # Сохранение изображения (в файл или буфер)
+        return render.save_figure(fig, f1, bbox_inches='tight', dpi=300)
 
 
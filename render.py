@@ -0,0 +1,111 @@
+import os
+import threading
+from io import BytesIO
+from contextlib import contextmanager
+
+import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+import assets
+import metrics
+
+
+# Повторно использовать фигуры вместо создания новых (0 - выключено)
+REUSE_FIGURES = int(os.environ.get('FA_REUSE_FIGURES', 4))
+
+# Потолок памяти, которую держат буферы отрисовки фигур в пуле
+RENDER_MAX_MB = int(os.environ.get('FA_RENDER_MAX_MB', 128))
+
+_lock = threading.Lock()
+_pool = []
+_live = set()
+_counters = {'live': 0, 'created': 0, 'reused': 0, 'released': 0}
+
+
+def _renderer_bytes(fig):
+    # Размер буфера Agg, который холст держит после последней отрисовки
+    renderer = getattr(fig.canvas, 'renderer', None)
+    if renderer is None:
+        return 0
+    return memoryview(renderer.buffer_rgba()).nbytes
+
+
+def _take_figure(figsize):
+    with _lock:
+        fig = _pool.pop() if _pool else None
+        _counters['live'] += 1
+        if fig is not None:
+            _counters['reused'] += 1
+    if fig is None:
+        # Фигура вне pyplot: ее не нужно закрывать через plt.close, память освобождается вместе с объектом
+        fig = Figure(figsize=figsize)
+        FigureCanvasAgg(fig)
+        with _lock:
+            _counters['created'] += 1
+    else:
+        fig.set_size_inches(figsize)
+    with _lock:
+        _live.add(fig)
+    return fig
+
+
+def _release_figure(fig):
+    fig.clear()
+    with _lock:
+        _counters['live'] -= 1
+        _live.discard(fig)
+        pooled_bytes = sum(_renderer_bytes(pooled) for pooled in _pool)
+        if len(_pool) < REUSE_FIGURES and pooled_bytes + _renderer_bytes(fig) <= RENDER_MAX_MB * 1024 * 1024:
+            _pool.append(fig)
+        else:
+            _counters['released'] += 1
+
+
+@contextmanager
+def figure(figsize=(10, 8)):
+    # Фигура для одного графика; после выхода из блока она очищается при любом исходе
+    assets.apply_styles()
+    fig = _take_figure(figsize)
+    try:
+        yield fig
+    finally:
+        _release_figure(fig)
+
+
+def stats():
+    # Текущее число фигур и память буферов отрисовки
+    with _lock:
+        figures = list(_pool) + list(_live)
+        result = dict(_counters)
+        result['pooled'] = len(_pool)
+    result['renderer_bytes'] = sum(_renderer_bytes(fig) for fig in figures)
+    result['pyplot_figures'] = len(plt.get_fignums())
+    return result
+
+
+def clear_pool():
+    with _lock:
+        _counters['released'] += len(_pool)
+        _pool.clear()
+
+
+@metrics.timed('render.save_figure')
+def save_figure(fig, target=None, **kwargs):
+    # target - путь к файлу или буфер; без target картинка возвращается в новом BytesIO, диск не используется
+    if target is None:
+        target = BytesIO()
+    fig.savefig(target, format='png', **kwargs)
+    if hasattr(target, 'seek'):
+        target.seek(0)
+    return target
+
+
+def save_image(image, target=None):
+    # То же для картинок PIL
+    if target is None:
+        target = BytesIO()
+    image.save(target, format='PNG')
+    if hasattr(target, 'seek'):
+        target.seek(0)
+    return target
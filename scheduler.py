@@ -0,0 +1,59 @@
+import os
+import asyncio
+
+
+# Сколько тяжелых задач (в очереди и в работе) бот принимает одновременно; сверх этого - быстрый отказ
+MAX_JOBS = int(os.environ.get('FA_MAX_JOBS', 16))
+
+
+class Busy(Exception):
+    # Очередь заполнена - пользователю нужно ответить сразу, а не ставить запрос в очередь
+    pass
+
+
+class Superseded(Exception):
+    # Пользователь отправил новый запрос того же вида, этот больше никому не нужен
+    pass
+
+
+class Scheduler:
+    # Не больше одной задачи на пользователя и вид задачи: новый запрос отменяет предыдущий.
+    # Отмена снимает задачу, которая еще ждет свободный рабочий процесс; задача, которая уже считается,
+    # доработает в пуле, но ее результат будет отброшен
+
+    def __init__(self, max_jobs=MAX_JOBS):
+        self.max_jobs = max_jobs
+        self._jobs = {}
+        self._superseded = set()
+        self.stats = {'started': 0, 'superseded': 0, 'rejected': 0}
+
+    async def run(self, user_id, kind, func, *args, **kwargs):
+        key = (user_id, kind)
+        previous = self._jobs.get(key)
+        if previous is not None and not previous.done():
+            self._superseded.add(previous)
+            previous.cancel()
+            self.stats['superseded'] += 1
+        elif len(self._jobs) >= self.max_jobs:
+            self.stats['rejected'] += 1
+            raise Busy()
+
+        task = asyncio.ensure_future(func(*args, **kwargs))
+        self._jobs[key] = task
+        self.stats['started'] += 1
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if task in self._superseded:
+                raise Superseded() from None
+            raise
+        finally:
+            self._superseded.discard(task)
+            if self._jobs.get(key) is task:
+                del self._jobs[key]
+
+    def report(self):
+        return dict(self.stats, active=len(self._jobs))
+
+
+jobs = Scheduler()
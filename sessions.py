@@ -0,0 +1,240 @@
+import os
+import time
+import pickle
+import asyncio
+import logging
+import weakref
+import importlib.util
+from collections import OrderedDict
+
+import lazy
+import metrics
+
+pd = lazy.module('pandas')
+
+logger = logging.getLogger(__name__)
+
+
+# Общий бюджет памяти на таблицы всех пользователей; сверх него самые давние сессии выгружаются на диск
+SESSION_MEMORY_MB = float(os.environ.get('FA_SESSION_MEMORY_MB', 256))
+
+# Через сколько секунд без действий сессия выгружается на диск, даже если бюджет не превышен
+SESSION_TTL = int(os.environ.get('FA_SESSION_TTL', 900))
+
+# Каталог выгруженных сессий и срок, после которого файлы удаляются (пользователь загрузит выгрузку заново)
+SESSION_DIR = os.environ.get('FA_SESSION_DIR', 'sessions')
+SESSION_DISK_DAYS = float(os.environ.get('FA_SESSION_DISK_DAYS', 7))
+
+# Как часто проверять сессии, которые пора выгрузить
+SWEEP_INTERVAL = int(os.environ.get('FA_SESSION_SWEEP', 60))
+
+# Таблицы выгружаются в parquet (сжато и с сохранением типов), без pyarrow - в pickle
+PARQUET = importlib.util.find_spec('pyarrow') is not None
+
+# Операции целиком в сессии не хранятся: аналитика, советы, прогноз и сравнение работают по кубу
+FRAMES = ('cube',)
+
+
+class Session:
+    # Данные загруженной выгрузки одного пользователя
+
+    def __init__(self, cube, period_index, fingerprint, filename):
+        self.cube = cube
+        self.period_index = period_index
+        self.fingerprint = fingerprint
+        self.filename = filename
+        self.nbytes = session_bytes(self)
+        self.last_used = time.monotonic()
+        # Сессия, загруженная с диска, уже лежит там в том же виде - повторно ее можно не записывать
+        self.on_disk = False
+
+
+def frame_bytes(frame):
+    return int(frame.memory_usage(index=True, deep=True).sum()) if frame is not None else 0
+
+
+def session_bytes(session):
+    period_bytes = sum(values.nbytes for values in getattr(session.period_index, '_cumsum', {}).values())
+    return frame_bytes(session.cube) + period_bytes
+
+
+class SessionStore:
+    # Сессии в памяти в порядке последнего обращения (LRU). Выгруженная сессия остается файлами
+    # на диске и загружается обратно при следующем обращении пользователя
+
+    def __init__(self, max_bytes=SESSION_MEMORY_MB * 1024 * 1024, ttl=SESSION_TTL, directory=SESSION_DIR):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.directory = directory
+        self._sessions = OrderedDict()
+        # Замок пользователя живет, пока его держит или ждет хоть одна задача: после выгрузки сессии
+        # словарь не копит замки всех, кто когда-либо пользовался ботом
+        self._locks = weakref.WeakValueDictionary()
+        self.nbytes = 0
+        self.spilled = 0
+        self.reloaded = 0
+
+    def _path(self, user_id, name):
+        extension = 'parquet' if PARQUET and name in FRAMES else 'pkl'
+        return os.path.join(self.directory, f'{user_id}.{name}.{extension}')
+
+    def _lock(self, user_id):
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = self._locks[user_id] = asyncio.Lock()
+        return lock
+
+    async def put(self, user_id, cube, period_index, fingerprint, filename):
+        async with self._lock(user_id):
+            self._forget(user_id)
+            session = Session(cube, period_index, fingerprint, filename)
+            self._sessions[user_id] = session
+            self.nbytes += session.nbytes
+            # Старые файлы относятся к прошлой выгрузке
+            await asyncio.to_thread(self._remove_files, user_id)
+        await self.sweep(keep=user_id)
+        return session
+
+    async def get(self, user_id):
+        # Сессия из памяти, а если она выгружена - с диска; None, если пользователь ничего не загружал
+        async with self._lock(user_id):
+            session = self._sessions.get(user_id)
+            if session is None:
+                session = await asyncio.to_thread(self._load, user_id)
+                if session is None:
+                    return None
+                self._sessions[user_id] = session
+                self.nbytes += session.nbytes
+                self.reloaded += 1
+            session.last_used = time.monotonic()
+            self._sessions.move_to_end(user_id)
+        await self.sweep(keep=user_id)
+        return session
+
+    async def drop(self, user_id):
+        async with self._lock(user_id):
+            self._forget(user_id)
+            await asyncio.to_thread(self._remove_files, user_id)
+
+    def _forget(self, user_id):
+        session = self._sessions.pop(user_id, None)
+        if session is not None:
+            self.nbytes -= session.nbytes
+
+    async def sweep(self, keep=None):
+        # Выгружаем сессии без действий дольше ttl, затем самые давние, пока не уложимся в бюджет.
+        # Сессия, с которой сейчас работает пользователь (keep), остается в памяти в любом случае
+        now = time.monotonic()
+        victims = [user_id for user_id, session in self._sessions.items()
+                   if user_id != keep and now - session.last_used > self.ttl]
+        excess = self.nbytes - self.max_bytes - sum(self._sessions[user_id].nbytes for user_id in victims)
+        for user_id, session in self._sessions.items():
+            if excess <= 0:
+                break
+            if user_id != keep and user_id not in victims:
+                victims.append(user_id)
+                excess -= session.nbytes
+        for user_id in victims:
+            await self._spill(user_id)
+
+    async def _spill(self, user_id):
+        async with self._lock(user_id):
+            session = self._sessions.get(user_id)
+            if session is None:
+                return
+            used = session.last_used
+            if not session.on_disk:
+                await asyncio.to_thread(self._save, user_id, session)
+            # Пока файлы писались, пользователь мог снова обратиться к сессии - тогда оставляем ее в памяти
+            if self._sessions.get(user_id) is session and session.last_used == used:
+                self._forget(user_id)
+                self.spilled += 1
+
+    async def spill_all(self):
+        # При остановке бота: после перезапуска (в том числе с другим числом процессов) сессии загрузятся с диска
+        for user_id in list(self._sessions):
+            await self._spill(user_id)
+
+    def _save(self, user_id, session):
+        with metrics.stage('sessions.spill', session.nbytes):
+            os.makedirs(self.directory, exist_ok=True)
+            for name in FRAMES:
+                frame = getattr(session, name)
+                if frame is None:
+                    continue
+                path = self._path(user_id, name)
+                temporary = f'{path}.tmp'
+                if PARQUET:
+                    frame.to_parquet(temporary, compression='zstd', index=False)
+                else:
+                    frame.to_pickle(temporary)
+                os.replace(temporary, path)
+            path = self._path(user_id, 'meta')
+            with open(f'{path}.tmp', 'wb') as file:
+                pickle.dump({'period_index': session.period_index, 'fingerprint': session.fingerprint,
+                             'filename': session.filename}, file, protocol=pickle.HIGHEST_PROTOCOL)
+            # meta пишется последним: без него сессия на диске считается неполной
+            os.replace(f'{path}.tmp', path)
+
+    def _load(self, user_id):
+        meta_path = self._path(user_id, 'meta')
+        if not os.path.exists(meta_path):
+            return None
+        if time.time() - os.path.getmtime(meta_path) > SESSION_DISK_DAYS * 86400:
+            self._remove_files(user_id)
+            return None
+        with metrics.stage('sessions.reload'):
+            with open(meta_path, 'rb') as file:
+                meta = pickle.load(file)
+            frames = {}
+            for name in FRAMES:
+                path = self._path(user_id, name)
+                if not os.path.exists(path):
+                    frames[name] = None
+                elif PARQUET:
+                    frames[name] = pd.read_parquet(path)
+                else:
+                    frames[name] = pd.read_pickle(path)
+            session = Session(frames['cube'], meta['period_index'], meta['fingerprint'], meta['filename'])
+        # Срок хранения файлов отсчитывается от последнего обращения
+        os.utime(meta_path)
+        session.on_disk = True
+        return session
+
+    def _remove_files(self, user_id):
+        for name in FRAMES + ('meta',):
+            path = self._path(user_id, name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def purge_disk(self):
+        # Удаляет файлы сессий старше SESSION_DISK_DAYS
+        if not os.path.isdir(self.directory):
+            return 0
+        removed = 0
+        limit = time.time() - SESSION_DISK_DAYS * 86400
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.getmtime(path) < limit:
+                os.remove(path)
+                removed += 1
+        return removed
+
+    def stats(self):
+        return {'in_memory': len(self._sessions), 'memory_mb': self.nbytes / 1024 / 1024,
+                'spilled': self.spilled, 'reloaded': self.reloaded}
+
+
+store = SessionStore()
+
+
+async def sweep_forever(interval=SWEEP_INTERVAL):
+    # Фоновая задача бота: выгружает сессии, у которых истек ttl, и удаляет старые файлы
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await store.sweep()
+            await asyncio.to_thread(store.purge_disk)
+        except Exception as e:
+            # Ошибка выгрузки не должна останавливать проверки: сессия просто останется в памяти
+            logger.error(f"Ошибка при выгрузке сессий: {e}")
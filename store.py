@@ -0,0 +1,173 @@
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+
+# Локальное хранилище операций пользователей
+DB_PATH = os.environ.get('FA_DB_PATH', 'transactions.db')
+
+# Сколько дней хранятся операции пользователя после его последней загрузки (0 - бессрочно)
+RETENTION_DAYS = int(os.environ.get('FA_DB_RETENTION_DAYS', 180))
+
+# Соответствие колонок подготовленной таблицы и колонок в базе
+COLUMNS = {
+    'Дата операции': 'op_date',
+    'Дата платежа': 'pay_date',
+    'Статус': 'status',
+    'Категория': 'category',
+    'Описание': 'description',
+    'Кэшбэк': 'cashback',
+    'Сумма операции': 'amount',
+    'Сумма платежа': 'pay_amount',
+    'Бонусы (включая кэшбэк)': 'bonus',
+    'Округление на инвесткопилку': 'invest_round',
+    'Сумма операции с округлением': 'amount_rounded',
+    'Пополнения': 'income',
+    'Траты': 'spend',
+}
+
+DATE_COLUMNS = ['Дата операции', 'Дата платежа']
+
+TEXT_COLUMNS = ['Статус', 'Категория', 'Описание']
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS transactions (
+    user_id INTEGER NOT NULL,
+    row_hash INTEGER NOT NULL,
+    dup_n INTEGER NOT NULL,
+    op_date TEXT,
+    pay_date TEXT,
+    status TEXT,
+    category TEXT,
+    description TEXT,
+    cashback REAL,
+    amount REAL,
+    pay_amount REAL,
+    bonus REAL,
+    invest_round REAL,
+    amount_rounded REAL,
+    income REAL,
+    spend REAL,
+    PRIMARY KEY (user_id, row_hash, dup_n)
+);
+CREATE INDEX IF NOT EXISTS ix_transactions_user_date ON transactions (user_id, op_date);
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    last_upload TEXT NOT NULL
+);
+-- Пользователи из базы, созданной до появления таблицы users: срок хранения считается с этого запуска
+INSERT OR IGNORE INTO users (user_id, last_upload) SELECT DISTINCT user_id, datetime('now') FROM transactions;
+'''
+
+_connections = {}
+
+
+def connect(path=None):
+    # Одно соединение на процесс и файл базы (рабочие процессы пула открывают свои)
+    path = path or DB_PATH
+    key = (os.getpid(), path)
+    if key not in _connections:
+        connection = sqlite3.connect(path, timeout=30)
+        # WAL позволяет читать базу из одних процессов, пока другой в нее пишет
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.executescript(SCHEMA)
+        _connections[key] = connection
+    return _connections[key]
+
+
+def _to_date_text(value, round_up=False):
+    # В базе хранятся только даты, а границы периода могут быть со временем (например, "сейчас минус месяц").
+    # Округляем так же, как сравнение с датой в полночь: начало - вверх, конец - вниз
+    value = pd.Timestamp(value)
+    value = value.ceil('D') if round_up else value.floor('D')
+    return value.strftime('%Y-%m-%d')
+
+
+def _rows_for_insert(user_id, data):
+    frame = pd.DataFrame(index=data.index)
+    for column, sql in COLUMNS.items():
+        if column in DATE_COLUMNS:
+            frame[sql] = data[column].dt.strftime('%Y-%m-%d').astype(object)
+        elif column in TEXT_COLUMNS:
+            frame[sql] = data[column].astype(object) if column in data else None
+        else:
+            # Приводим числа к одному типу, иначе хэши одинаковых строк из разных выгрузок разойдутся
+            frame[sql] = pd.to_numeric(data[column], errors='coerce').astype('float64') if column in data else np.nan
+
+    # Ключ строки - хэш всех ее значений и номер повтора: две одинаковые покупки в один день
+    # остаются двумя строками, а пересечение со старой выгрузкой не дублируется
+    hashes = pd.util.hash_pandas_object(frame, index=False).to_numpy().view('int64')
+    frame.insert(0, 'row_hash', hashes)
+    frame.insert(1, 'dup_n', frame.groupby('row_hash').cumcount())
+    frame.insert(0, 'user_id', user_id)
+    frame = frame.astype(object).where(frame.notna(), None)
+    return frame.itertuples(index=False, name=None)
+
+
+def merge_upload(user_id, data, path=None):
+    # Добавляет новую выгрузку к операциям пользователя, возвращает число новых строк
+    connection = connect(path)
+    columns = ['user_id', 'row_hash', 'dup_n'] + list(COLUMNS.values())
+    placeholders = ', '.join('?' for _ in columns)
+    with connection:
+        before = connection.total_changes
+        connection.executemany(
+            f'INSERT OR IGNORE INTO transactions ({", ".join(columns)}) VALUES ({placeholders})',
+            _rows_for_insert(user_id, data),
+        )
+        added = connection.total_changes - before
+        connection.execute("INSERT OR REPLACE INTO users (user_id, last_upload) VALUES (?, datetime('now'))",
+                           [user_id])
+        return added
+
+
+def _period_clause(start_date, end_date):
+    clause = 'user_id = ?'
+    params = []
+    if start_date is not None:
+        clause += ' AND op_date >= ?'
+        params.append(_to_date_text(start_date, round_up=True))
+    if end_date is not None:
+        clause += ' AND op_date <= ?'
+        params.append(_to_date_text(end_date))
+    return clause, params
+
+
+def load_frame(user_id, start_date=None, end_date=None, path=None):
+    # Операции пользователя за период в формате preparing (выборка по индексу user_id, op_date)
+    clause, params = _period_clause(start_date, end_date)
+    select = ', '.join(f'{sql} AS "{column}"' for column, sql in COLUMNS.items())
+    data = pd.read_sql_query(
+        f'SELECT {select} FROM transactions WHERE {clause} ORDER BY op_date DESC',
+        connect(path), params=[user_id] + params,
+    )
+    for column in DATE_COLUMNS:
+        data[column] = pd.to_datetime(data[column], format='%Y-%m-%d')
+    return data
+
+
+def delete_user(user_id, path=None):
+    # Все операции пользователя (команда /forget); возвращает число удаленных строк
+    connection = connect(path)
+    with connection:
+        deleted = connection.execute('DELETE FROM transactions WHERE user_id = ?', [user_id]).rowcount
+        connection.execute('DELETE FROM users WHERE user_id = ?', [user_id])
+    return deleted
+
+
+def purge_stale(days=RETENTION_DAYS, path=None):
+    # Удаляет операции пользователей, которые ничего не загружали больше days дней; возвращает их число
+    if days <= 0:
+        return 0
+    connection = connect(path)
+    cutoff = f'-{days} days'
+    with connection:
+        stale = [row[0] for row in connection.execute(
+            "SELECT user_id FROM users WHERE last_upload < datetime('now', ?)", [cutoff])]
+        for user_id in stale:
+            connection.execute('DELETE FROM transactions WHERE user_id = ?', [user_id])
+            connection.execute('DELETE FROM users WHERE user_id = ?', [user_id])
+    return len(stale)
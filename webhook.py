@@ -0,0 +1,181 @@
+import os
+import json
+import hmac
+import signal
+import asyncio
+import logging
+import secrets
+
+from telegram import Update
+
+
+# Локальный HTTP-сервер для обновлений Telegram. Снаружи его обычно закрывает обратный прокси с TLS
+WEBHOOK_HOST = os.environ.get('FA_WEBHOOK_HOST', '127.0.0.1')
+WEBHOOK_PORT = int(os.environ.get('FA_WEBHOOK_PORT', 8080))
+WEBHOOK_PATH = os.environ.get('FA_WEBHOOK_PATH', '/telegram')
+
+# Общий секрет: Telegram присылает его в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_SECRET = os.environ.get('FA_WEBHOOK_SECRET', '')
+
+# Публичный адрес, который регистрируется в Telegram; пустой - вебхук зарегистрирован заранее (например, прокси)
+WEBHOOK_URL = os.environ.get('FA_WEBHOOK_URL', '')
+
+# Ограничения на запрос: обновление Telegram - несколько килобайт JSON
+MAX_BODY = 1024 * 1024
+READ_TIMEOUT = 10
+
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+
+REASONS = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found', 405: 'Method Not Allowed',
+           408: 'Request Timeout', 413: 'Payload Too Large'}
+
+logger = logging.getLogger(__name__)
+
+
+async def _read_request(reader):
+    # Строка запроса, заголовки и тело; соединение обслуживает один запрос
+    request_line = (await reader.readline()).decode('latin-1').split()
+    if len(request_line) != 3:
+        raise ValueError('Некорректная строка запроса')
+    method, target, _ = request_line
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get('content-length', 0))
+    if length > MAX_BODY:
+        return method, target, headers, None
+    body = await reader.readexactly(length) if length else b''
+    return method, target, headers, body
+
+
+def _response(writer, status, text=''):
+    body = text.encode('utf-8')
+    writer.write(f'HTTP/1.1 {status} {REASONS[status]}\r\n'
+                 f'Content-Type: text/plain; charset=utf-8\r\n'
+                 f'Content-Length: {len(body)}\r\n'
+                 f'Connection: close\r\n\r\n'.encode('latin-1') + body)
+
+
+class WebhookServer:
+    # Принимает POST с обновлением, проверяет секрет и кладет обновление в очередь приложения -
+    # дальше оно обрабатывается теми же обработчиками, что и при run_polling.
+    # dispatch - своя обработка разобранного JSON (например, пересылка в процесс бота в cluster.py)
+
+    def __init__(self, application, host=WEBHOOK_HOST, port=WEBHOOK_PORT, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET,
+                 dispatch=None):
+        self.application = application
+        self.dispatch = dispatch or self.enqueue
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret = secret
+        self.accepted = 0
+        self.rejected = 0
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        # Порт 0 - свободный порт, который выбрала система
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"Вебхук слушает http://{self.host}:{self.port}{self.path}")
+        return self
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            status = await asyncio.wait_for(self._process(reader), READ_TIMEOUT)
+        except asyncio.TimeoutError:
+            status = 408
+        except (ValueError, asyncio.IncompleteReadError):
+            status = 400
+        if status != 200:
+            self.rejected += 1
+        try:
+            _response(writer, status, 'ok' if status == 200 else REASONS[status])
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    async def _process(self, reader):
+        method, target, headers, body = await _read_request(reader)
+        if target == '/healthz':
+            return 200
+        if target.split('?')[0] != self.path:
+            return 404
+        if method != 'POST':
+            return 405
+        if not hmac.compare_digest(headers.get(SECRET_HEADER, '').encode('latin-1'), self.secret.encode('latin-1')):
+            return 403
+        if body is None:
+            return 413
+        try:
+            data = json.loads(body)
+            if not isinstance(data, dict) or 'update_id' not in data:
+                return 400
+            await self.dispatch(data)
+        except (ValueError, TypeError, KeyError):
+            return 400
+        self.accepted += 1
+        return 200
+
+    async def enqueue(self, data):
+        await self.application.update_queue.put(Update.de_json(data, self.application.bot))
+
+
+def resolve_secret(secret, url):
+    # Случайный секрет годится, только если бот сам регистрирует вебхук (url): иначе Telegram его не знает,
+    # и сервер отвечал бы 403 на каждое обновление
+    if secret:
+        return secret
+    if not url:
+        raise RuntimeError("Для FA_MODE=webhook задайте FA_WEBHOOK_SECRET - тот же секрет, что указан при "
+                           "регистрации вебхука, - или FA_WEBHOOK_URL, чтобы бот зарегистрировал вебхук сам")
+    logger.warning("FA_WEBHOOK_SECRET не задан, используется случайный секрет этого запуска")
+    return secrets.token_urlsafe(32)
+
+
+def wait_for_stop_signal():
+    # Ctrl+C или SIGTERM; на Windows обработчики сигналов в event loop недоступны - там сработает KeyboardInterrupt
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for name in ('SIGINT', 'SIGTERM'):
+        try:
+            loop.add_signal_handler(getattr(signal, name), stop.set)
+        except (NotImplementedError, RuntimeError, AttributeError):
+            pass
+    return stop.wait()
+
+
+async def run(application, host=WEBHOOK_HOST, port=WEBHOOK_PORT, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET,
+              url=WEBHOOK_URL, stop=None):
+    # Аналог run_polling: инициализация приложения, post_init, прием обновлений до сигнала остановки
+    secret = resolve_secret(secret, url)
+
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        if url:
+            await application.bot.set_webhook(url=url, secret_token=secret, allowed_updates=Update.ALL_TYPES)
+        await application.start()
+        server = await WebhookServer(application, host, port, path, secret).start()
+        try:
+            await (stop if stop is not None else wait_for_stop_signal())
+        finally:
+            await server.stop()
+            await application.stop()
+    # Как в run_polling: post_shutdown - после Application.shutdown()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
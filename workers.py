@@ -0,0 +1,223 @@
+import os
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from io import BytesIO
+
+import lazy
+import chartcache
+import metrics
+
+# Тяжелые модули загружаются при первом обращении: процессу бота для старта они не нужны,
+# рабочие процессы импортируют их сразу при запуске (warm_up_worker)
+pd = lazy.module('pandas')
+cmal = lazy.module('common_analys')
+pred = lazy.module('pred')
+adv = lazy.module('advice')
+ingest = lazy.module('ingest')
+store = lazy.module('store')
+cube = lazy.module('cube')
+assets = lazy.module('assets')
+
+
+logger = logging.getLogger(__name__)
+
+# Размер пула рабочих процессов (по умолчанию - число ядер)
+POOL_SIZE = int(os.environ.get('FA_POOL_SIZE', os.cpu_count() or 1))
+
+_executors = None
+_slots = None
+
+
+def get_executors():
+    global _executors
+    if _executors is None:
+        # spawn вместо fork: в родительском процессе уже крутится event loop и потоки telegram.
+        # У каждого рабочего процесса свой исполнитель: задачу можно отправить в конкретный процесс
+        # (прогноз - туда, где лежат обученные модели), а не в первый освободившийся
+        context = multiprocessing.get_context('spawn')
+        count = max(1, POOL_SIZE)
+        _executors = [ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=warm_up_worker,
+                                          initargs=(count,)) for _ in range(count)]
+    return _executors
+
+
+def warm_up_worker(count=1):
+    # Замеры этапов в рабочем процессе не хранятся, а возвращаются в процесс бота вместе с результатом
+    metrics.forward()
+    lazy.warm_up()
+    assets.warm_up()
+    # FA_MODEL_CACHE_MB - предел на весь пул: каждому из count процессов достается своя доля
+    pred.model_cache.max_bytes = pred.MODEL_CACHE_MB * 1024 * 1024 // count
+    pred.model_cache.max_entries = max(1, pred.MODEL_CACHE_ENTRIES // count)
+
+
+def ping():
+    # Ответ рабочего процесса после старта: pid и время прогрева стилей, шрифтов и картинок
+    return os.getpid(), assets.report()
+
+
+def warm_up():
+    # Запускает рабочие процессы заранее, чтобы первый пользователь не ждал их старта и импортов
+    return [executor.submit(ping) for executor in get_executors()]
+
+
+def get_slots():
+    # Задач в пуле не больше, чем рабочих процессов: остальные ждут здесь, и отмена такой задачи
+    # ничего не стоит (из очереди исполнителя уже отправленную задачу не убрать).
+    # Общий семафор - сколько задач в работе, замки и счетчики - какой процесс занят или уже обещан задаче
+    global _slots
+    loop = asyncio.get_running_loop()
+    if _slots is None or _slots[0] is not loop:
+        count = max(1, POOL_SIZE)
+        _slots = (loop, asyncio.Semaphore(count), [asyncio.Lock() for _ in range(count)], [0] * count)
+    return _slots[1:]
+
+
+async def run_heavy(func, *args, **kwargs):
+    # Выполняем тяжелую функцию в свободном рабочем процессе, event loop при этом обслуживает только ввод-вывод Telegram
+    return await _run(None, func, args, kwargs)
+
+
+async def run_pinned(key, func, *args, **kwargs):
+    # То же, но задачи с одинаковым ключом всегда выполняет один и тот же рабочий процесс
+    return await _run(hash(key) % max(1, POOL_SIZE), func, args, kwargs)
+
+
+async def _run(index, func, args, kwargs):
+    loop = asyncio.get_running_loop()
+    semaphore, locks, claimed = get_slots()
+    with metrics.stage(f'pool.{func.__name__}'):
+        # Семафор берется раньше замка, поэтому у задачи с семафором всегда есть процесс, который никому не обещан
+        async with semaphore:
+            if index is None:
+                index = claimed.index(0)
+            claimed[index] += 1
+            try:
+                async with locks[index]:
+                    result, records = await loop.run_in_executor(get_executors()[index],
+                                                                 partial(run_measured, func, args, kwargs))
+            finally:
+                claimed[index] -= 1
+    metrics.ingest(records)
+    return result
+
+
+def run_measured(func, args, kwargs):
+    # Задача целиком и все этапы внутри нее; pool.* в процессе бота дополнительно включает ожидание в очереди
+    with metrics.stage(f'job.{func.__name__}', metrics.input_size(args)):
+        result = func(*args, **kwargs)
+    return result, metrics.drain()
+
+
+def shutdown():
+    global _executors
+    if _executors is not None:
+        for executor in _executors:
+            executor.shutdown(wait=False, cancel_futures=True)
+        _executors = None
+
+
+# Задачи, которые выполняются в рабочих процессах.
+# Они должны быть объявлены на уровне модуля, чтобы их можно было передать в пул.
+
+def load_export(file_data, user_id):
+    # Новая выгрузка дописывается к уже сохраненным операциям пользователя без дублей,
+    # и по всей истории сразу строится куб агрегатов для аналитики, советов и прогноза
+    df = ingest.read_export(file_data)
+    added = store.merge_upload(user_id, df)
+    # Заодно удаляются операции тех, кто давно ничего не загружал (FA_DB_RETENTION_DAYS)
+    store.purge_stale()
+    df = store.load_frame(user_id)
+    if ingest.COMPACT:
+        df = ingest.compact(df)
+    data_cube = cube.build_cube(df)
+    logger.info(f"Операций пользователя: {len(df)}, {ingest.bytes_per_row(df):.0f} байт на операцию, "
+                f"куб: {len(data_cube)} строк")
+    # В процесс бота уходит только куб: операции целиком после его построения не нужны.
+    # Отпечаток куба - часть ключа кэша графиков: новая выгрузка сама делает старые картинки недоступными
+    return data_cube, cube.PeriodIndex(data_cube), pred.data_fingerprint(data_cube), len(df), added
+
+
+def forget_user(user_id):
+    return store.delete_user(user_id)
+
+
+# Графики аналитики в порядке отправки; all_spending и all_repl дают одну или две картинки
+CHART_KINDS = ('spend_days', 'all_spending', 'all_repl', 'cashback')
+
+
+def period_key(start_date, end_date):
+    # Операции в кубе датированы полночью, поэтому период сводится к целым дням:
+    # "последний месяц", запрошенный дважды за день, дает один и тот же ключ и ту же выборку
+    return pd.Timestamp(start_date).ceil('D'), pd.Timestamp(end_date).floor('D')
+
+
+def render_chart(kind, processed_df):
+    # Картинки рисуются сразу в память: ни временных файлов, ни конфликтов имен между пользователями
+    if kind == 'spend_days':
+        return [cmal.spend_days(processed_df)]
+
+    if kind == 'cashback':
+        return [cmal.cashback(processed_df, 'images/patrik.jpg')]
+
+    draw = cmal.all_spending if kind == 'all_spending' else cmal.all_repl
+    f1, f2, f3 = BytesIO(), BytesIO(), BytesIO()
+    count = draw(processed_df, f1, f2, f3)
+    return [f1, f2] if count == 2 else [f3]
+
+
+def analytics_job(data_cube, start_date, end_date, kinds=CHART_KINDS):
+    # Все графики строятся по кубу: стоимость зависит от числа дней и категорий, а не операций
+    processed_df = cmal.filter_data_by_date(start_date, end_date, data_cube)
+    return {kind: [buffer.getvalue() for buffer in render_chart(kind, processed_df)] for kind in kinds}
+
+
+async def analytics(data_cube, fingerprint, start_date, end_date):
+    # Готовые картинки берутся из кэша; в пул уходят только недостающие графики
+    start_date, end_date = period_key(start_date, end_date)
+    charts = {}
+    if fingerprint is not None:
+        for kind in CHART_KINDS:
+            images = chartcache.chart_cache.get((fingerprint, start_date, end_date, kind))
+            if images is not None:
+                charts[kind] = images
+
+    missing = [kind for kind in CHART_KINDS if kind not in charts]
+    if missing:
+        rendered = await run_heavy(analytics_job, data_cube, start_date, end_date, missing)
+        for kind, images in rendered.items():
+            if fingerprint is not None:
+                chartcache.chart_cache.put((fingerprint, start_date, end_date, kind), images)
+            charts[kind] = images
+
+    return [image for kind in CHART_KINDS for image in charts[kind]]
+
+
+def compare_job(period_index, first_period, second_period, labels):
+    # Суммы за оба периода - по два обращения к накопленным суммам, без прохода по операциям
+    first = period_index.totals(*first_period)
+    second = period_index.totals(*second_period)
+    image = cmal.compare_periods(first, second, labels).getvalue()
+    return image, cmal.compare_summary(first, second, labels)
+
+
+def advice_job(data_cube):
+    filtered_data = adv.filter_by_date(data_cube)
+    return adv.advicing(filtered_data)
+
+
+def forecast_job(data_cube, count, engine=None, owner=None):
+    # engine - движок прогноза для этого запроса ('arima', 'fast', 'auto'); по умолчанию FA_FORECAST_ENGINE.
+    # owner - пользователь: его модели из прошлых запросов обновляются новыми месяцами, а не обучаются заново
+    return pred.pred_spend(data_cube, count, engine=engine, owner=owner).getvalue()
+
+
+async def forecast(data_cube, fingerprint, count, engine=None, owner=None):
+    # Кэш обученных моделей у каждого рабочего процесса свой, поэтому прогнозы пользователя всегда считает
+    # один процесс: запросы на 1, 3, 6, 12 месяцев подряд обучают модели один раз, а после новой выгрузки
+    # модели обновляются там, где они уже лежат. Без владельца процесс выбирается по отпечатку данных
+    key = owner if owner is not None else fingerprint
+    return await run_pinned(key, forecast_job, data_cube, count, engine=engine, owner=owner)